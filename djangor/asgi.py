@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+
+使用asgi部署时需要在配置文件中开启 async_view，例如：
+uvicorn djangor.asgi:application --host 0.0.0.0 --port 9002 --workers 4
 """
 
 import os
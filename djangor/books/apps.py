@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class BooksConfig(AppConfig):
     name = 'books'
+
+    def ready(self):
+        # 用户变更时清除认证缓存，在应用加载时注册，shell、脚本等未导入认证模块的进程同样生效
+        from django.conf import settings
+        from django.db.models.signals import post_delete, post_save
+        from djangor.utils.auth import clear_user_credentials
+
+        post_save.connect(clear_user_credentials, sender=settings.AUTH_USER_MODEL, dispatch_uid="clear_user_credentials")
+        post_delete.connect(clear_user_credentials, sender=settings.AUTH_USER_MODEL, dispatch_uid="clear_user_credentials")
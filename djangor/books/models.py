@@ -37,6 +37,7 @@ class BookModel(RichBaseModel):
         verbose_name = "书"
         verbose_name_plural = verbose_name
         ordering = ["-update_time"]  # 指明默认排序规则,查询之后自动将结果排序
+        indexes = [models.Index(fields=["is_deleted", "update_time", "id"], name="book_update_cursor_idx")]  # 游标分页
 
 
 class LabelModel(RichBaseModel):
@@ -51,6 +52,7 @@ class LabelModel(RichBaseModel):
         db_table = "books_label"
         verbose_name = "标签表"
         verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=["is_deleted", "update_time", "id"], name="label_update_cursor_idx")]  # 游标分页
 
 
 class BookBeLabelModel(BaseModel):
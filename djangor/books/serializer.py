@@ -5,12 +5,12 @@
 # @Author  : wuyazibest
 # @Email   : wuyazibest@163.com
 # @Desc   :
-import json
-
 from rest_framework import serializers
 
 from .models import *
-from djangor.utils import BaseSerializer, ChoiceField, redis_store
+from djangor.utils import BaseSerializer, ChoiceField, VersionedCache, get_choice_codec
+
+kind_codec = get_choice_codec(BookKind.choices)
 
 
 class BookSerializer(BaseSerializer):
@@ -18,43 +18,52 @@ class BookSerializer(BaseSerializer):
     # choice 对应的中文方法二，需要定义 get_kind_display_2 函数
     kind_display_2 = serializers.SerializerMethodField()
     # choice 对应的中文方法三 ，需要DRF (3.6.3) 以后支持
-    kind_display_3 = serializers.CharField(source="get_kind_display")
+    kind_display_3 = serializers.CharField(source="get_kind_display", read_only=True)
+
+    fast_read = True
+    fast_fields = {
+        "kind_display_2": ("kind", lambda x: kind_codec.label(x, x)),
+        "kind_display_1": ("kind", kind_codec.label),
+        }
 
     class Meta:
         model = BookModel
         exclude = ["is_deleted"]
 
     def get_kind_display_2(self, obj):
-        return obj.get_kind_display()
+        return kind_codec.label(obj.kind, obj.kind)
 
     def to_representation(self, instance):
         """Convert `username` to lowercase."""
         ret = super().to_representation(instance)
         # choice 对应的中文方法一
-        ret["kind_display_1"] = {x[0]: x[1] for x in BookKind.choices}.get(instance.kind)
+        ret["kind_display_1"] = kind_codec.label(instance.kind)
         return ret
 
 
 class LabelSerializer(BaseSerializer):
+    fast_read = True
+    
     class Meta:
         model = LabelModel
         fields = "__all__"
     
     @classmethod
     def get_map(cls):
-        key = "book_label_map"
-        data_map = redis_store.get(key)
-        if data_map:
-            data_map = json.loads(data_map)
-        else:
-            data_list = cls(instance=cls.Meta.model.get_active().all(), many=True).data
-            data_map = {x["id"]: x for x in data_list}
-            redis_store.set(key, json.dumps(data_map), ex=60 * 60 * 24 * 7)
-        return data_map
+        return label_map_cache.get()
+    
+    @classmethod
+    def load_map(cls):
+        data_list = cls.fast_data(cls.Meta.model.get_active().all())
+        return {str(x["id"]): x for x in data_list}  # 与从redis中json反序列化后的键类型保持一致
     
     def save(self, **kwargs):
-        redis_store.delete("book_label_map")
-        return super(LabelSerializer, self).save(**kwargs)
+        instance = super(LabelSerializer, self).save(**kwargs)
+        label_map_cache.invalidate()
+        return instance
+
+
+label_map_cache = VersionedCache("book_label_map", LabelSerializer.load_map, timeout=60 * 60 * 24 * 7)
 
 
 class BookBeLabelSerializer(BaseSerializer):
@@ -64,12 +73,51 @@ class BookBeLabelSerializer(BaseSerializer):
     
     @classmethod
     def get_label(cls, book_id):
-        data_list = cls(instance=cls.Meta.model.objects.filter(book_id=book_id).all(), many=True).data
-        return [LabelSerializer.get_map()[x["label_id"]] for x in data_list]
+        return cls.get_label_map([book_id])[book_id]
+    
+    @classmethod
+    def get_label_map(cls, book_id_list):
+        """
+        批量查询书籍的标签，关系表只查询一次，标签信息从标签缓存中获取
+        :param book_id_list: 书籍id列表
+        :return: {book_id: [label_info, ...]}
+        """
+        data_map = {x: [] for x in book_id_list}
+        if not data_map:
+            return data_map
+        
+        label_map = LabelSerializer.get_map()
+        relation = cls.Meta.model.objects.filter(book_id__in=data_map).values_list("book_id", "label_id")
+        for book_id, label_id in relation:
+            label_info = label_map.get(str(label_id))
+            if label_info:
+                data_map[book_id].append(label_info)
+        return data_map
     
     @classmethod
     def get_book(cls, label_id):
-        data_list = cls(instance=cls.Meta.model.objects.filter(label_id=label_id).all(), many=True).data
-        book_id_list = [x["book_id"] for x in data_list]
-        return BookSerializer(instance=BookModel.objects.filter(id__in=book_id_list, is_deleted=0).all(),
-                              many=True).data
+        return cls.get_book_map([label_id])[label_id]
+    
+    @classmethod
+    def get_book_map(cls, label_id_list):
+        """
+        批量查询标签下的书籍，关系表与书籍表各查询一次，同一本书只序列化一次
+        :param label_id_list: 标签id列表
+        :return: {label_id: [book_info, ...]}
+        """
+        data_map = {x: [] for x in label_id_list}
+        if not data_map:
+            return data_map
+        
+        book_label_map = {}
+        for label_id, book_id in cls.Meta.model.objects.filter(label_id__in=data_map).values_list("label_id", "book_id"):
+            book_label_map.setdefault(book_id, []).append(label_id)
+        if not book_label_map:
+            return data_map
+        
+        # 按书籍默认排序遍历，保持与单个标签查询时一致的书籍顺序
+        book_list = BookSerializer(instance=BookModel.get_active().filter(id__in=book_label_map).all(), many=True).data
+        for book_info in book_list:
+            for label_id in book_label_map[book_info["id"]]:
+                data_map[label_id].append(book_info)
+        return data_map
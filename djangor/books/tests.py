@@ -1,3 +1,312 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import http.server
+import json
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager
+from unittest import mock, skipIf
+
+from aiohttp import web
+
+from django.test import SimpleTestCase, TestCase
+
+from .serializer import *
+from djangor import config
+from djangor.utils import Redis, AsyncRedis, VersionedCache, parse_url, parse_urls, aparse_url, aparse_urls
+
+try:
+    from fakeredis import TcpFakeServer  # 测试依赖，作为本地 redis 替身，见 requirements-dev.txt
+except ImportError:
+    TcpFakeServer = None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
 
 # Create your tests here.
+class FastDataTest(TestCase):
+    """fast_data 与 DRF 序列化结果一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            LabelModel.objects.create(name=f"label{i}", description="" if i % 2 else f"说明{i}", is_used=bool(i % 2))
+        for i in range(10):
+            BookModel.objects.create(
+                name=f"book{i}",
+                writer=f"writer{i}" if i % 3 else "",
+                kind=BookKind.choices[i % len(BookKind.choices)][0],
+                publishing=i % 2,
+                publication_date=datetime.date(2020, 1, i + 1) if i % 2 else None,
+                )
+
+    def assert_same(self, serializer_class, instance):
+        self.assertIsNotNone(serializer_class.compile_fast())
+        fast = serializer_class.fast_data(instance)
+        data = serializer_class(instance, many=True).data
+        self.assertEqual([list(x.items()) for x in fast], [list(x.items()) for x in data])
+
+    def test_queryset(self):
+        self.assert_same(BookSerializer, BookModel.get_active().all())
+        self.assert_same(LabelSerializer, LabelModel.get_active().all())
+
+    def test_slice(self):
+        self.assert_same(BookSerializer, BookModel.get_active().all()[2:7])
+        self.assert_same(LabelSerializer, LabelModel.get_active().all()[:3])
+
+    def test_instance_list(self):
+        self.assert_same(BookSerializer, list(BookModel.get_active().all()))
+        self.assert_same(LabelSerializer, list(LabelModel.get_active().all()))
+
+    def test_evaluated_queryset(self):
+        instance = BookModel.get_active().all()
+        len(instance)
+        with self.assertNumQueries(0):
+            fast = BookSerializer.fast_data(instance)
+        self.assertEqual(len(fast), len(instance))
+        self.assert_same(BookSerializer, instance)
+
+    def test_null_date(self):
+        instance = BookModel.get_active().filter(publication_date__isnull=True)
+        self.assertTrue(instance.exists())
+        self.assertTrue(all(x["publication_date"] is None for x in BookSerializer.fast_data(instance)))
+        self.assert_same(BookSerializer, instance)
+
+    def test_empty(self):
+        self.assertEqual(BookSerializer.fast_data(BookModel.objects.none()), [])
+
+
+@skipIf(TcpFakeServer is None, "需要安装 fakeredis")
+class RedisTest(SimpleTestCase):
+    """同步/异步 redis 封装与两级缓存，连接本地 redis 替身服务"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+        cls.port = cls.server.server_address[1]
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.store = Redis(host="127.0.0.1", port=cls.port)
+        cls.astore = AsyncRedis(host="127.0.0.1", port=cls.port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.store.flushdb()
+
+    def test_batch(self):
+        with self.store.batch() as pipe:
+            pipe.set("a", 1, ex=60)
+            pipe.incr("a")
+            pipe.get("a")
+        self.assertEqual(pipe.results, [True, 2, "2"])
+        self.assertEqual(self.store.ttl("a"), 60)
+
+    def test_mget_map(self):
+        self.store.mset_ex({"a": 1, "b": 2}, ex=60)
+        self.assertEqual(self.store.mget_map(["a", "b", "c"]), {"a": "1", "b": "2", "c": None})
+        self.assertEqual(self.store.mget_map([]), {})
+
+    def test_error_swallowed(self):
+        store = Redis(host="127.0.0.1", port=free_port(), socket_timeout=1)
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.mget_map(["a", "b"]), {"a": None, "b": None})
+        with store.batch() as pipe:
+            pipe.set("a", 1)
+        self.assertIsNone(pipe.results)
+
+    async def test_async(self):
+        self.assertTrue(await self.astore.set("a", 1))
+        self.assertEqual(await self.astore.get("a"), "1")
+        await self.astore.mset_ex({"b": 2}, ex=60)
+        self.assertEqual(await self.astore.mget_map(["a", "b", "c"]), {"a": "1", "b": "2", "c": None})
+        self.assertEqual(self.store.get("b"), "2")
+
+    async def test_async_error_swallowed(self):
+        store = AsyncRedis(host="127.0.0.1", port=free_port(), socket_timeout=1)
+        self.assertIsNone(await store.get("a"))
+        self.assertEqual(await store.mget_map(["a", "b"]), {"a": None, "b": None})
+        async with store.batch() as pipe:
+            pipe.set("a", 1)
+        self.assertIsNone(pipe.results)
+
+    async def test_versioned_cache(self):
+        source = {"value": 1}
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return dict(source)
+
+        cache = VersionedCache("test_versioned_cache", loader)
+        with mock.patch("djangor.utils.comment.redis_store", self.store), \
+                mock.patch("djangor.utils.comment.aredis_store", self.astore):
+            self.assertEqual(await cache.aget(), {"value": 1})
+            self.assertEqual(await cache.aget(), {"value": 1})
+            self.assertEqual(cache.get(), {"value": 1})
+            self.assertEqual(len(calls), 1)
+
+            source["value"] = 2
+            self.assertEqual(await cache.aget(), {"value": 1})
+            await cache.ainvalidate()
+            self.assertEqual(await cache.aget(), {"value": 2})
+            self.assertEqual(len(calls), 2)
+
+            # 其他进程的缓存：进程内缓存为空，直接读取 redis 中当前版本的数据
+            other = VersionedCache("test_versioned_cache", loader)
+            self.assertEqual(await other.aget(), {"value": 2})
+            self.assertEqual(len(calls), 2)
+            cache.invalidate()
+            source["value"] = 3
+            self.assertEqual(await other.aget(), {"value": 3})
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    本地 http 替身服务，/bad 返回 500，参数 delay 为响应前等待的秒数
+    记录每个请求的客户端端口，用于判断连接是否复用
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.client_ports.append(self.client_address[1])
+        path, _, query = self.path.partition("?")
+        params = dict(x.split("=", 1) for x in query.split("&") if "=" in x)
+        time.sleep(float(params.get("delay", 0)))
+        status, body = (500, b"error") if path == "/bad" else (200, json.dumps({"path": path}).encode())
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ParseUrlTest(SimpleTestCase):
+    """parse_url / parse_urls，请求本地 http 替身服务"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.server.client_ports = []
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.client_ports.clear()
+
+    def test_parse_url(self):
+        self.assertEqual(parse_url(f"{self.url}/a"), {"path": "/a"})
+        self.assertEqual(parse_url(f"{self.url}/bad"), {})
+        with self.assertRaises(Exception):
+            parse_url(f"{self.url}/bad", raise_exception=True)
+
+    def test_order(self):
+        # 后面的请求先完成，结果仍按传入顺序返回
+        calls = [{"url": f"{self.url}/{i}", "params": {"delay": 0.05 * (4 - i)}} for i in range(5)]
+        self.assertEqual(parse_urls(calls), [{"path": f"/{i}"} for i in range(5)])
+
+    def test_failure(self):
+        calls = [{"url": f"{self.url}/a"}, {"url": f"{self.url}/bad"}, {"url": f"{self.url}/b"}]
+        self.assertEqual(parse_urls(calls), [{"path": "/a"}, {}, {"path": "/b"}])
+        with self.assertRaises(Exception):
+            parse_urls(calls, raise_exception=True)
+
+    def test_connection_reuse(self):
+        for i in range(5):
+            parse_url(f"{self.url}/{i}")
+        self.assertEqual(len(self.server.client_ports), 5)
+        self.assertEqual(len(set(self.server.client_ports)), 1)
+
+        self.server.client_ports.clear()
+        calls = [{"url": f"{self.url}/{i}", "params": {"delay": 0.02}} for i in range(config.REQUEST_POOL_SIZE * 3)]
+        parse_urls(calls)
+        self.assertLessEqual(len(set(self.server.client_ports)), config.REQUEST_POOL_SIZE)
+
+
+@asynccontextmanager
+async def aiohttp_stub():
+    """本地 aiohttp 替身服务，/bad 返回 500，参数 delay 为响应前等待的秒数，返回服务地址"""
+    async def handle(request):
+        await asyncio.sleep(float(request.query.get("delay", 0)))
+        if request.path == "/bad":
+            return web.Response(status=500, text="error")
+        return web.json_response({"path": request.path})
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}"
+    finally:
+        await runner.cleanup()
+
+
+class AsyncParseUrlTest(SimpleTestCase):
+    """aparse_url / aparse_urls，请求本地 aiohttp 替身服务"""
+
+    async def test_aparse_url(self):
+        async with aiohttp_stub() as url:
+            self.assertEqual(await aparse_url(f"{url}/a"), {"path": "/a"})
+            self.assertEqual(await aparse_url(f"{url}/bad"), {})
+            self.assertEqual(await aparse_url(f"{url}/slow", params={"delay": 0.6}, timeout=0.2), {})
+            with self.assertRaises(Exception):
+                await aparse_url(f"{url}/bad", raise_exception=True)
+
+    async def test_completion_order(self):
+        async with aiohttp_stub() as url:
+            calls = [{"url": f"{url}/{i}", "params": {"delay": 0.05 * (4 - i)}} for i in range(5)]
+            results = [x async for x in aparse_urls(calls)]
+        self.assertEqual([x[0] for x in results], [4, 3, 2, 1, 0])
+        self.assertEqual(dict(results), {i: {"path": f"/{i}"} for i in range(5)})
+
+    async def test_concurrency(self):
+        async with aiohttp_stub() as url:
+            calls = [{"url": f"{url}/{i}", "params": {"delay": 0.2}} for i in range(4)]
+            tt = time.monotonic()
+            results = [x async for x in aparse_urls(calls, concurrency=2)]
+            cost = time.monotonic() - tt
+        self.assertEqual(len(results), 4)
+        self.assertGreaterEqual(cost, 0.4)
+        self.assertLess(cost, 0.8)
+
+    async def test_failure_and_timeout(self):
+        async with aiohttp_stub() as url:
+            calls = [{"url": f"{url}/bad"}, {"url": f"{url}/slow", "params": {"delay": 0.6}}, {"url": f"{url}/a"}]
+            results = dict([x async for x in aparse_urls(calls, timeout=0.2)])
+            self.assertEqual(results, {0: {}, 1: {}, 2: {"path": "/a"}})
+            with self.assertRaises(Exception):
+                async for _ in aparse_urls(calls, timeout=0.2, raise_exception=True):
+                    pass
+
+    async def test_budget(self):
+        async with aiohttp_stub() as url:
+            calls = [{"url": f"{url}/slow", "params": {"delay": 0.6}}, {"url": f"{url}/a"}]
+            tt = time.monotonic()
+            results = [x async for x in aparse_urls(calls, budget=0.3)]
+            self.assertLess(time.monotonic() - tt, 0.5)
+            self.assertEqual(results, [(1, {"path": "/a"}), (0, {})])
+            with self.assertRaises(Exception):
+                async for _ in aparse_urls(calls, budget=0.3, raise_exception=True):
+                    pass
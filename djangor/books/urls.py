@@ -13,6 +13,7 @@ urlpatterns = [
     path("", index, name="index"),
     path("book/menu_option/", BookView.as_view({"get": "menu_option"}), name="book"),
     path("book/query_attach_label/", BookView.as_view({"post": "query_attach_label"}), name="book"),
+    path("book/bulk/", BookView.as_view({"post": "bulk_create", "put": "bulk_update"}), name="book"),
     path("book/", BookView.as_view({
         "get": "get_query",
         "post": "create",
@@ -20,12 +21,16 @@ urlpatterns = [
         "delete": "delete",
         }), name="book"),
     path("label/query_attach_book/", LabelView.as_view({"post": "query_attach_book"}), name="label"),
+    path("label/bulk/", LabelView.as_view({"post": "bulk_create", "put": "bulk_update"}), name="label"),
     path("label/", LabelView.as_view({
         "get": "get_query",
         "post": "create",
         "put": "update",
         "delete": "delete",
         }), name="label"),
+    path("related/set_labels/", BookBeLabelView.as_view({"post": "set_labels"}), name="related"),
+    path("related/set_books/", BookBeLabelView.as_view({"post": "set_books"}), name="related"),
+    path("related/bulk/", BookBeLabelView.as_view({"post": "bulk_create"}), name="related"),
     path("related/", BookBeLabelView.as_view({
         "post": "create",
         "delete": "abs_delete",
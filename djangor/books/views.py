@@ -1,11 +1,15 @@
-from django.http import HttpResponse
+import hashlib
+import json
+
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import render
 
 # Create your views here.
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 
 from .serializer import *
-from djangor.utils import BaseView, logger, Pager, RET, json_resp
+from djangor.utils import BaseView, logger, RET, json_resp, get_choice_codec, PlusException
 
 
 @api_view(["GET", "POST"])
@@ -20,6 +24,7 @@ class BookView(BaseView):
     queryset = BookModel.get_active()
     serializer_class = BookSerializer
     resources = "书籍"
+    cache_timeout = 60 * 5
     query_field = (
         "id",
         "name",
@@ -51,12 +56,18 @@ class BookView(BaseView):
         "publishing",
         )
     
+    menu_option_data = {
+        "kind": get_choice_codec(BookKind.choices).labels,
+        "publishing": get_choice_codec(BookModel.PUBLISHING_CHOICE).labels,
+        }
+    menu_option_etag = '"%s"' % hashlib.md5(json.dumps(menu_option_data, sort_keys=True).encode()).hexdigest()
+    
     def menu_option(self, request, *args, **kwargs):
-        data = {
-            "kind": {x[0]: x[1] for x in BookKind.choices},
-            "publishing": {x[0]: x[1] for x in BookModel.PUBLISHING_CHOICE},
-            }
-        return json_resp(RET.OK, f"{self.resources}菜单选项查询成功", data=data)
+        if request.META.get("HTTP_IF_NONE_MATCH") == self.menu_option_etag:
+            return HttpResponseNotModified()
+        resp = json_resp(RET.OK, f"{self.resources}菜单选项查询成功", data=self.menu_option_data)
+        resp["ETag"] = self.menu_option_etag
+        return resp
     
     def query_attach_label(self, request, *args, **kwargs):
         try:
@@ -64,23 +75,13 @@ class BookView(BaseView):
             params = {x: request.data.get(x) for x in self.query_field if request.data.get(x, "") != ""}
             
             instance = self.queryset.filter(**params).all()
-            offset = request.data.get("offset")
-            limit = request.data.get("limit")
-            if offset and limit:
-                pag = Pager(instance, limit)
-                instance = pag.page(offset)
-                total = pag.total
-            else:
-                instance = instance
-                total = len(instance)
-            serializer = self.get_serializer(instance, many=True)
+            instance, page_info = self.query_page(instance, request.data)
+            data = self.serialize_list(instance)
+            label_map = BookBeLabelSerializer.get_label_map([x["id"] for x in data])
+            for i in data:
+                i["label_info"] = label_map[i["id"]]
             
-            data = []
-            for i in serializer.data:
-                i["label_info"] = BookBeLabelSerializer.get_label(i["id"])
-                data.append(i)
-            
-            return json_resp(RET.OK, f"{self.resources}查询成功", data=data, total=total)
+            return json_resp(RET.OK, f"{self.resources}查询成功", data=data, **page_info)
         except Exception as e:
             logger.error(f"{self.resources}查询错误 params:{request.data} error:{e}")
             return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}查询错误 error:{e}", data=None)
@@ -90,6 +91,7 @@ class LabelView(BaseView):
     queryset = LabelModel.get_active()
     serializer_class = LabelSerializer
     resources = "标签"
+    cache_timeout = 60 * 5
     query_field = (
         "id",
         "name",
@@ -113,29 +115,23 @@ class LabelView(BaseView):
             params = {x: request.data.get(x) for x in self.query_field if request.data.get(x, "") != ""}
             
             instance = self.queryset.filter(**params).all()
-            offset = request.data.get("offset")
-            limit = request.data.get("limit")
-            if offset and limit:
-                pag = Pager(instance, limit)
-                instance = pag.page(offset)
-                total = pag.total
-            else:
-                instance = instance
-                total = len(instance)
-            serializer = self.get_serializer(instance, many=True)
-            
-            data = []
-            for i in serializer.data:
-                i["book_info"] = BookBeLabelSerializer.get_book(i["id"])
-                data.append(i)
+            instance, page_info = self.query_page(instance, request.data)
+            data = self.serialize_list(instance)
+            book_map = BookBeLabelSerializer.get_book_map([x["id"] for x in data])
+            for i in data:
+                i["book_info"] = book_map[i["id"]]
             
-            return json_resp(RET.OK, f"{self.resources}查询成功", data=data, total=total)
+            return json_resp(RET.OK, f"{self.resources}查询成功", data=data, **page_info)
         except Exception as e:
             logger.error(f"{self.resources}查询错误 params:{request.data} error:{e}")
             return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}查询错误 error:{e}", data=None)
     
     def delete_queryset(self):
         return self.queryset.filter(is_used=False)
+    
+    def clear_cache(self):
+        super().clear_cache()
+        label_map_cache.invalidate()
 
 
 class BookBeLabelView(BaseView):
@@ -150,3 +146,65 @@ class BookBeLabelView(BaseView):
         "book_id",
         "label_id",
         )
+    
+    @staticmethod
+    def parse_id(value, name):
+        """只接受整数和由数字组成的字符串，小数、布尔值等直接报错，不做截断"""
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.isdecimal():
+            return int(value)
+        raise PlusException(f"{name}格式错误:{value}")
+    
+    def set_related(self, request, key, related_key, owner_queryset, related_queryset):
+        """
+        设置 key 对应的全部 related_key，读取一次现有关系后比较差异，
+        在同一个事务中批量插入新增的关系、一条 DELETE ... IN 删除去掉的关系，只清除关系表的缓存
+        :param owner_queryset: key 所属的有效数据，key 不存在或已删除时返回 NODATA
+        :param related_queryset: related_key 所属的有效数据，新增的 related_key 需要存在其中
+        :return: {"added": [...], "removed": [...]}
+        """
+        pk = request.data.get(key)
+        related_list = request.data.get(related_key)
+        if pk is None or not isinstance(related_list, list):
+            raise PlusException(f"缺少{key}或{related_key}参数")
+        pk = self.parse_id(pk, key)
+        related_set = {self.parse_id(x, related_key) for x in related_list}
+        
+        model = self.queryset.model
+        with transaction.atomic():
+            # 锁住所属数据，避免设置期间被删除
+            if not owner_queryset.filter(id=pk).select_for_update().exists():
+                raise PlusException(f"{key}不存在:{pk}", code=RET.NODATA)
+            current = dict(model.objects.select_for_update().filter(**{key: pk}).values_list(related_key, "id"))
+            added = sorted(related_set - set(current))
+            removed = sorted(set(current) - related_set)
+            
+            missing = set(added) - set(related_queryset.filter(id__in=added).values_list("id", flat=True))
+            if missing:
+                raise PlusException(f"{related_key}不存在:{sorted(missing)}")
+            model.data_bulk_create([{key: pk, related_key: x, "user": request.user.username} for x in added],
+                                   batch_size=self.bulk_batch_size)
+            if removed:
+                model.objects.filter(id__in=[current[x] for x in removed]).delete()
+        if added or removed:
+            self.clear_cache()
+        return {"added": added, "removed": removed}
+    
+    def set_labels(self, request, *args, **kwargs):
+        try:
+            logger.info(f"{self.resources}设置书籍标签 user:{request.user.username} params:{request.data}")
+            data = self.set_related(request, "book_id", "label_id", BookModel.get_active(), LabelModel.get_active())
+            return json_resp(RET.OK, f"{self.resources}设置成功", data=data)
+        except Exception as e:
+            logger.error(f"{self.resources}设置错误 params:{request.data} error:{e}")
+            return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}设置错误 error:{e}", data=None)
+    
+    def set_books(self, request, *args, **kwargs):
+        try:
+            logger.info(f"{self.resources}设置标签书籍 user:{request.user.username} params:{request.data}")
+            data = self.set_related(request, "label_id", "book_id", LabelModel.get_active(), BookModel.get_active())
+            return json_resp(RET.OK, f"{self.resources}设置成功", data=data)
+        except Exception as e:
+            logger.error(f"{self.resources}设置错误 params:{request.data} error:{e}")
+            return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}设置错误 error:{e}", data=None)
@@ -23,9 +23,11 @@ DEBUG = _CONFIG.getboolean("default", "debug")
 
 DEFAULT_REQUEST_TIMEOUT = _CONFIG.getint("default", "request_timeout")
 DEFAULT_REQUEST_RETRY = _CONFIG.getint("default", "request_retry")
+REQUEST_POOL_SIZE = _CONFIG.getint("default", "request_pool_size")  # 每个域名保持的最大连接数
 THREAD_NUMBER = _CONFIG.getint("default", "thread_number")
 MAX_RETRY_TIMES = _CONFIG.getint("default", "max_retry_times")
 WAIT_TIME = _CONFIG.getint("default", "wait_time")
+ASYNC_VIEW = _CONFIG.getboolean("default", "async_view")  # asgi 部署时开启，BaseView 的子类使用异步视图
 
 
 class MysqlConf:
@@ -47,3 +49,7 @@ class RedisConf:
     db1 = _CONFIG.getint("redis", "db1")
     db2 = _CONFIG.getint("redis", "db2")
     expires = _CONFIG.getint("redis", "expires")
+    count_expires = _CONFIG.getint("redis", "count_expires")
+    max_connections = _CONFIG.getint("redis", "max_connections")
+    health_check_interval = _CONFIG.getint("redis", "health_check_interval")
+    socket_timeout = _CONFIG.getint("redis", "socket_timeout")
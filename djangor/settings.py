@@ -148,11 +148,8 @@ REST_FRAMEWORK = {
         ],
     # 认证处理方式
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'djangor.utils.auth.ApiAuthentication',  # 自定义认证
-        'djangor.utils.auth.ThirdPartyAuthentication',  # 自定义认证
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',  # JWT认证
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        # 按认证方式分发到 api/public/third 自定义认证、JWT认证、Basic认证、Session认证
+        'djangor.utils.auth.SchemeAuthentication',
         ),
     # 异常处理
     'EXCEPTION_HANDLER': 'djangor.utils.exceptions.my_exception_handler',
@@ -216,6 +213,10 @@ JWT_AUTH = {
     'JWT_RESPONSE_PAYLOAD_HANDLER': 'djangor.utils.auth.jwt_response_payload_handler',  # 登录成功后返回的参数
     'JWT_AUTH_COOKIE': 'Authorization'  # 认证是否支持cookie
     }
+# JWT认证直接使用token中的 user_id 和 username 构造用户，不查询数据库，访问其他用户属性时才查询
+# 开启后不再每次检查 is_active，只依赖保存用户时写入redis的禁用标记，
+# 通过 queryset.update() 等不触发信号的方式禁用的用户，在token有效期(JWT_EXPIRATION_DELTA)内仍可通过认证
+JWT_USER_SNAPSHOT = False
 
 # 自定义的用户模型类
 # AUTH_USER_MODEL = 'users.User'
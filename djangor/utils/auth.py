@@ -5,14 +5,21 @@
 # @Author  : wuyazibest
 # @Email   : wuyazibest@163.com
 # @Desc   :
-import datetime
+import hashlib
+import json
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
+from django.db.models.signals import post_delete
+from django.utils import timezone
 from rest_framework import exceptions
-from rest_framework.authentication import BaseAuthentication
+from rest_framework.authentication import BaseAuthentication, BasicAuthentication, SessionAuthentication
 from rest_framework.permissions import BasePermission
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+from rest_framework_jwt.settings import api_settings as jwt_settings
 
-from djangor.utils import logger
+from djangor.utils import logger, LocalCache, redis_store
 
 
 
@@ -47,11 +54,30 @@ class IsAuthenticatedOrReadOnly(BasePermission):
 # ============================================================================
 # authentication 权限验证方式：token有效性校验
 
+CREDENTIAL_VERSION_KEY = "user_credential_version"
+
+
+_credential_version_cache = LocalCache(timeout=1, max_size=1)
+
+
+def credential_version():
+    """
+    认证缓存的版本号，用户信息变更时加一，进程内认证缓存的键中带有版本号，所有进程下次认证时重新校验
+    版本号在进程内缓存1秒，认证缓存命中时每秒最多读取一次redis，其他进程最多延迟1秒感知用户变更
+    redis 不可用时返回 "0"，进程内缓存最多使用到有效期结束
+    """
+    version = _credential_version_cache.get("version")
+    if version is None:
+        version = redis_store.get(CREDENTIAL_VERSION_KEY) or "0"
+        _credential_version_cache.set("version", version)
+    return version
+
 class ApiAuthentication(BaseAuthentication):
     """
     用于api接口校验，其他系统调用api接口，校验的因子需要不变的
     """
     www_authenticate_realm = 'api'
+    credential_cache = LocalCache(timeout=60, max_size=10000)  # 认证通过的用户，键中带有 credential_version
     
     def authenticate(self, request):
         # Authorization
@@ -59,7 +85,12 @@ class ApiAuthentication(BaseAuthentication):
         auth = auth.split()
         if not auth or auth[0].lower() != self.www_authenticate_realm:
             return None
-        
+        return self.authenticate_parts(auth)
+    
+    def authenticate_parts(self, auth):
+        """
+        :param auth: 按空格拆分后的认证信息 [realm, username, password]
+        """
         if len(auth) < 3:
             msg = 'Invalid basic header. No credentials provided.'
             raise exceptions.AuthenticationFailed(msg)
@@ -71,6 +102,15 @@ class ApiAuthentication(BaseAuthentication):
         return self.authenticate_credentials(username, password)
     
     def authenticate_credentials(self, username, password):
+        key = hashlib.sha256(f"{self.www_authenticate_realm}:{username}:{password}".encode()).hexdigest()
+        key = f"{credential_version()}:{key}"
+        user = self.credential_cache.get(key)
+        if user is None:
+            user = self.load_credentials(username, password)
+            self.credential_cache.set(key, user)
+        return (user, None)
+    
+    def load_credentials(self, username, password):
         UserModel = get_user_model()
         try:
             user = UserModel.objects.get(username="api_user", password=password)
@@ -88,7 +128,7 @@ class ApiAuthentication(BaseAuthentication):
         if not user.is_active:
             raise exceptions.AuthenticationFailed('User inactive or deleted.')
         
-        return (user, None)
+        return user
     
     def authenticate_header(self, request):
         return 'authentication realm="%s"' % self.www_authenticate_realm
@@ -97,7 +137,7 @@ class ApiAuthentication(BaseAuthentication):
 class PublicAuthentication(ApiAuthentication):
     www_authenticate_realm = 'public'
     
-    def authenticate_credentials(self, username, password):
+    def load_credentials(self, username, password):
         UserModel = get_user_model()
         try:
             user = UserModel.objects.get(username=username, password=password)
@@ -115,11 +155,19 @@ class PublicAuthentication(ApiAuthentication):
         if not user.is_active:
             raise exceptions.AuthenticationFailed('User inactive or deleted.')
         
-        return (user, None)
+        return user
 
 
 class ThirdPartyAuthentication(BaseAuthentication):
+    """
+    第三方token校验，校验结果先缓存在进程内，再缓存在redis中，缓存有效期内不再请求第三方
+    校验失败的token也会缓存一段较短的时间，避免重复请求第三方
+    """
     www_authenticate_realm = 'third'
+    token_timeout = 60 * 5  # 校验通过的token缓存时间
+    reject_timeout = 30  # 校验失败的token缓存时间
+    last_login_interval = 60 * 10  # 最后登录时间的最短更新间隔
+    token_cache = LocalCache(timeout=token_timeout, max_size=10000)  # {版本号:key: 用户对象 或 校验失败信息}
     
     def authenticate(self, request):
         # Authorization
@@ -130,7 +178,12 @@ class ThirdPartyAuthentication(BaseAuthentication):
         auth = auth.split()
         if not auth or auth[0].lower() != self.www_authenticate_realm:
             return None
-        
+        return self.authenticate_parts(auth)
+    
+    def authenticate_parts(self, auth):
+        """
+        :param auth: 按空格拆分后的认证信息 [realm, token]
+        """
         if len(auth) < 2:
             msg = 'Invalid basic header. No credentials provided.'
             raise exceptions.AuthenticationFailed(msg)
@@ -142,11 +195,42 @@ class ThirdPartyAuthentication(BaseAuthentication):
         return self.authenticate_credentials(token)
     
     def authenticate_credentials(self, token):
+        key = f"third_token:{hashlib.sha256(token.encode()).hexdigest()}"
+        local_key = f"{credential_version()}:{key}"
+        user = self.token_cache.get(local_key)
+        if user is None:
+            user = self.load_credentials(token, key, local_key)
+        if isinstance(user, str):
+            raise exceptions.AuthenticationFailed(f'Invalid failed {user}.')
+        
+        self.update_last_login(user)
+        return (user, token)
+    
+    def load_credentials(self, token, key, local_key):
+        """
+        进程内缓存未命中时先查redis，redis中没有再请求第三方校验
+        :param key: redis 中的键
+        :param local_key: 进程内缓存的键
+        :return: 用户对象 或 校验失败信息
+        """
         UserModel = get_user_model()
         
+        cache = redis_store.get(key)
+        if cache:
+            cache = json.loads(cache)
+            if "message" in cache:
+                self.token_cache.set(local_key, cache["message"], self.reject_timeout)
+                return cache["message"]
+            user = UserModel.objects.filter(pk=cache["user_id"]).first()
+            if user is not None:
+                self.token_cache.set(local_key, user)
+                return user
+        
         res = third_check_token(token)
         if not res["ok"]:
-            raise exceptions.AuthenticationFailed(f'Invalid failed {res["message"]}.')
+            self.token_cache.set(local_key, res["message"], self.reject_timeout)
+            redis_store.set(key, json.dumps({"message": res["message"]}), ex=self.reject_timeout)
+            return res["message"]
         
         username = res["data"]["username"]
         try:
@@ -160,10 +244,141 @@ class ThirdPartyAuthentication(BaseAuthentication):
             logger.error(f"{self.www_authenticate_realm}认证失败，username：{username},error: {e}")
             raise exceptions.AuthenticationFailed(f"本地用户创建失败 {e}")
         
-        user.last_login = datetime.datetime.now()
-        user.save()
+        self.token_cache.set(local_key, user)
+        redis_store.set(key, json.dumps({"user_id": user.pk}), ex=self.token_timeout)
+        return user
+    
+    def update_last_login(self, user):
+        now = timezone.now()
+        if user.last_login and (now - user.last_login).total_seconds() < self.last_login_interval:
+            return
+        user.last_login = now
+        user.save(update_fields=["last_login"])
+
+
+class UserSnapshot(object):
+    """
+    根据JWT中的 user_id 和 username 构造的轻量用户对象，不查询数据库
+    访问其他属性时才从数据库加载完整的用户
+    """
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    
+    def __init__(self, user_id, username):
+        self.id = self.pk = user_id
+        self.username = username
+        self._user = None
+    
+    def __getattr__(self, item):
+        if item.startswith("__") or item == "_user":
+            raise AttributeError(item)
+        if self._user is None:
+            self._user = get_user_model().objects.get(pk=self.pk)
+        return getattr(self._user, item)
+    
+    def __str__(self):
+        return self.username
+    
+    def __eq__(self, other):
+        return getattr(other, "pk", None) == self.pk
+    
+    def __hash__(self):
+        return hash(self.pk)
+
+
+def user_disabled_key(user_id):
+    return f"user_disabled:{user_id}"
+
+
+class SnapshotJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    开启 JWT_USER_SNAPSHOT 时直接使用token中的用户信息，不再查询数据库
+    用户被禁用或删除时在redis中记录，在token有效期内拒绝该用户的请求
+    禁用标记由保存/删除用户的信号写入，不触发信号的更新（如 queryset.update）不会写入，
+    这类被禁用的用户在token有效期(JWT_EXPIRATION_DELTA)内仍可通过认证
+    redis 不可用时无法确认禁用标记，回退到查询数据库检查 is_active
+    """
+    
+    def authenticate_credentials(self, payload):
+        if not getattr(settings, "JWT_USER_SNAPSHOT", False):
+            return super().authenticate_credentials(payload)
+        
+        user_id = payload.get("user_id")
+        username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+        if not user_id or not username:
+            raise exceptions.AuthenticationFailed('Invalid payload.')
+        disabled = redis_store.exists(user_disabled_key(user_id))
+        if disabled is None:
+            return super().authenticate_credentials(payload)
+        if disabled:
+            raise exceptions.AuthenticationFailed('User account is disabled.')
+        return UserSnapshot(user_id, username)
+
+
+class SchemeAuthentication(BaseAuthentication):
+    """
+    按认证方式分发，认证信息只解析一次，直接交给对应的认证类，不再依次尝试所有认证类
+    请求头：api/public/third 交给自定义认证，JWT 交给JWT认证，Basic 交给Basic认证
+    没有请求头时读取cookie：third 开头的交给第三方认证，其他交给JWT认证
+    都没有或无法识别时使用session认证
+    """
+    api = ApiAuthentication()
+    public = PublicAuthentication()
+    third = ThirdPartyAuthentication()
+    jwt = SnapshotJSONWebTokenAuthentication()
+    session = SessionAuthentication()
+    basic = BasicAuthentication()
+    
+    def authenticate(self, request):
+        auth = request.META.get('HTTP_AUTHORIZATION', '')
+        if auth:
+            auth = auth.split()
+            scheme = auth[0].lower() if auth else ""
+            if scheme == self.api.www_authenticate_realm:
+                return self.api.authenticate_parts(auth)
+            if scheme == self.public.www_authenticate_realm:
+                return self.public.authenticate_parts(auth)
+            if scheme == self.third.www_authenticate_realm:
+                return self.third.authenticate_parts(auth)
+            if scheme == jwt_settings.JWT_AUTH_HEADER_PREFIX.lower():
+                return self.jwt.authenticate(request)
+            if scheme == "basic":
+                return self.basic.authenticate(request)
+        else:
+            cookie = request.COOKIES.get("Authorization", '').split()
+            if cookie and cookie[0].lower() == self.third.www_authenticate_realm:
+                return self.third.authenticate_parts(cookie)
+            if jwt_settings.JWT_AUTH_COOKIE and request.COOKIES.get(jwt_settings.JWT_AUTH_COOKIE):
+                return self.jwt.authenticate(request)
         
-        return (user, token)
+        return self.session.authenticate(request)
+    
+    def authenticate_header(self, request):
+        return self.api.authenticate_header(request)
+
+
+CREDENTIAL_FIELDS = {"username", "password", "is_active"}  # 影响认证结果的用户字段
+
+
+def clear_user_credentials(sender, instance, update_fields=None, **kwargs):
+    """
+    用户信息变更或删除时清除本进程中该用户的认证缓存，指定了 update_fields 且不涉及 CREDENTIAL_FIELDS 时不清除
+    同时认证缓存版本号加一，其他进程的缓存键随之变化，下次认证时重新校验
+    用户被禁用或删除时在redis中记录，供 SnapshotJSONWebTokenAuthentication 拒绝该用户的token
+    在 BooksConfig.ready 中注册，不依赖是否导入了本模块
+    """
+    if update_fields and not set(update_fields) & CREDENTIAL_FIELDS:
+        return
+    ApiAuthentication.credential_cache.delete_where(lambda user: user.pk == instance.pk)
+    ThirdPartyAuthentication.token_cache.delete_where(lambda user: getattr(user, "pk", None) == instance.pk)
+    redis_store.incr(CREDENTIAL_VERSION_KEY)
+    _credential_version_cache.clear()
+    
+    if kwargs.get("signal") is post_delete or not instance.is_active:
+        redis_store.set(user_disabled_key(instance.pk), 1, ex=jwt_settings.JWT_EXPIRATION_DELTA)
+    else:
+        redis_store.delete(user_disabled_key(instance.pk))
 
 
 # ===================================================================
@@ -191,8 +406,8 @@ class ThirdPartyAuthBackend(ModelBackend):
             logger.error("用户查询失败 %s " % e)
             return None
         
-        user.last_login = datetime.datetime.now()
-        user.save()
+        user.last_login = timezone.now()
+        user.save(update_fields=["last_login"])
         return user
 
 
@@ -5,13 +5,32 @@
 # @Author  : wuyazibest
 # @Email   : wuyazibest@163.com
 # @Desc   :
+import asyncio
 import datetime
-from django.db import models
-from rest_framework import serializers, viewsets
+import functools
+import hashlib
+import json
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, models, transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+from django.utils.encoding import force_str
+from django.utils.hashable import make_hashable
+from rest_framework import ISO_8601, serializers, viewsets
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueTogetherValidator
 
 from rest_framework.decorators import action
 
-from djangor.utils import logger, json_resp, RET, Pager, PlusException
+from djangor import config
+from djangor.utils import logger, json_resp, json_stream_resp, RET, Pager, CursorPager, PlusException, query_count, \
+    estimate_count, SingleFlight, redis_store, get_generation, bump_generation
 
 
 # ================================================================
@@ -48,6 +67,43 @@ class BooleanField(models.BooleanField):
         return super(BooleanField, self).to_python(value)
 
 
+class ChoiceCodec(object):
+    """
+    choice 编解码，存储值与展示名的正反向查找表只构建一次
+    同一组 choices 通过 get_choice_codec 共享同一个实例
+    """
+    
+    def __init__(self, choices):
+        self.choices = choices
+        self.labels = dict(choices)  # 存储值 -> 展示名
+        self.values = {}  # 展示名 -> 存储值，展示名重复时取第一个
+        for value, label in choices:
+            self.values.setdefault(label, value)
+    
+    def label(self, value, default=None):
+        try:
+            return self.labels.get(value, default)
+        except TypeError:
+            return default
+
+
+_choice_codecs = {}
+
+
+def get_choice_codec(choices):
+    """
+    :param choices: ((存储值, 展示名), ...) 或 {存储值: 展示名}
+    """
+    choices = tuple(choices.items()) if hasattr(choices, "items") else tuple(tuple(x) for x in choices)
+    try:
+        codec = _choice_codecs.get(choices)
+    except TypeError:
+        return ChoiceCodec(choices)
+    if codec is None:
+        codec = _choice_codecs[choices] = ChoiceCodec(choices)
+    return codec
+
+
 class ChoiceMixin:
     """
     有点：对于视图层透明，使用obj.field得到的是choice转换后的值
@@ -56,6 +112,7 @@ class ChoiceMixin:
     
     def __init__(self, choices_dict, *args, **kwargs):
         self.choices_dict = choices_dict
+        self.codec = get_choice_codec(choices_dict)
         super().__init__(*args, **kwargs)
     
     def get_prep_value(self, value):
@@ -63,13 +120,13 @@ class ChoiceMixin:
         """
         if value is None:
             return None
-        value = [k for k, v in self.choices_dict.items() if v == value][0]
+        value = self.codec.values[value]
         return super().get_prep_value(value)
     
     def from_db_value(self, value, expression, connection):
         """从数据库取出数据加工后吐出
         """
-        return self.choices_dict.get(value) or value
+        return self.codec.label(value) or value
     
     def deconstruct(self):
         name, path, args, kwargs = super().deconstruct()
@@ -92,21 +149,29 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
     
+    @classmethod
+    def clear_cache(cls):
+        """数据变更后清除该表相关的缓存，查询结果和查询总数的缓存键中都带有版本号，版本号加一即可"""
+        bump_generation(cls)
+    
     @classmethod
     def data_bulk_create(cls, data_list, batch_size=500):
         if data_list:
             obj_list = [cls(**x) for x in data_list]
             cls.objects.bulk_create(obj_list, batch_size=batch_size)
+            cls.clear_cache()
     
     @classmethod
     def data_bulk_update(cls, data_list, fields, batch_size=500):
         if data_list:
+            fields = list(fields)
             if "update_time" not in fields:
                 fields.append("update_time")
             
-            update_time = datetime.datetime.now()
+            update_time = timezone.now()
             obj_list = [cls(**dict(x, **{"update_time": update_time})) for x in data_list]
             cls.objects.bulk_update(obj_list, fields, batch_size=batch_size)
+            cls.clear_cache()
 
 
 class RichBaseModel(BaseModel):
@@ -126,27 +191,163 @@ class RichBaseModel(BaseModel):
 # serializer
 
 class ChoiceField(serializers.ChoiceField):
+    def _set_choices(self, choices):
+        super()._set_choices(choices)
+        self.codec = get_choice_codec(self._choices)
+    
+    choices = property(serializers.ChoiceField._get_choices, _set_choices)
+    
     def to_internal_value(self, data):
         if data == "" and self.allow_blank:
             return ""
         
-        for key, val in self._choices.items():
-            if val == data:
-                return key
-        self.fail("invalid_choice", input=data)
+        try:
+            return self.codec.values[data]
+        except (KeyError, TypeError):
+            self.fail("invalid_choice", input=data)
     
     def to_representation(self, value):
-        return self._choices[value]
+        return self.codec.labels[value]
 
 
 class BaseSerializer(serializers.ModelSerializer):
     create_time = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
     update_time = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
+    
+    fast_read = False  # 列表查询使用 fast_data 快速序列化
+    # 无法自动编译的字段 {字段名: (模型字段名, 转换函数)}，不在序列化字段中的按顺序追加在最后，对应 to_representation 中追加的字段
+    fast_fields = {}
+    
+    @classmethod
+    def fast_data(cls, instance):
+        """
+        只读快速序列化，输出与 cls(instance, many=True).data 一致
+        字段列表按类编译一次，之后直接把 values_list 的元组转换为字典，跳过DRF逐字段的处理流程
+        :param instance: queryset 或模型对象列表，已经取出数据的 queryset 直接使用其中的对象，不再重复查询
+        """
+        compiled = cls.compile_fast()
+        if not compiled:
+            return cls(instance, many=True).data
+        
+        columns, converters = compiled
+        if isinstance(instance, QuerySet) and instance._result_cache is None:
+            rows = instance.values_list(*columns)
+        elif len(columns) == 1:
+            rows = ((getattr(x, columns[0]),) for x in instance)
+        else:
+            rows = map(attrgetter(*columns), instance)
+        return [{name: func(row[index]) for name, index, func in converters} for row in rows]
+    
+    @classmethod
+    def compile_fast(cls):
+        """
+        编译字段列表，结果缓存在类上
+        :return: (查询的列名列表, [(输出字段名, 列序号, 转换函数), ...])，存在无法编译的字段时返回 None
+        """
+        if "_fast_compiled" in cls.__dict__:
+            return cls._fast_compiled
+        
+        model = cls.Meta.model
+        column_map = {x.name: x for x in model._meta.concrete_fields}
+        columns, converters = [], []
+        fields = cls().fields
+        for name, field in fields.items():
+            if field.write_only:
+                continue
+            source, func = cls.fast_fields.get(name) or cls._fast_field(field, column_map)
+            if source is None:
+                logger.warning(f"{cls.__name__} 字段 {name} 无法编译，使用DRF序列化")
+                cls._fast_compiled = None
+                return None
+            if source not in columns:
+                columns.append(source)
+            converters.append((name, columns.index(source), func))
+        
+        for name, (source, func) in cls.fast_fields.items():
+            if name not in fields:
+                if source not in columns:
+                    columns.append(source)
+                converters.append((name, columns.index(source), func))
+        
+        cls._fast_compiled = (columns, converters)
+        return cls._fast_compiled
+    
+    @staticmethod
+    def _fast_field(field, column_map):
+        """
+        普通模型字段和 get_xxx_display 字段可以自动编译
+        :return: (模型字段名, 转换函数)
+        """
+        if len(field.source_attrs) != 1:
+            return None, None
+        source = field.source_attrs[0]
+        to_representation = field.to_representation
+        if isinstance(field, serializers.DateTimeField):
+            to_representation = BaseSerializer._fast_datetime(field)
+        
+        if source in column_map:
+            return column_map[source].attname, lambda x: None if x is None else to_representation(x)
+        
+        matched = re.fullmatch(r"get_(\w+)_display", source)
+        if matched and matched.group(1) in column_map and column_map[matched.group(1)].choices:
+            model_field = column_map[matched.group(1)]
+            codec = get_choice_codec(make_hashable(model_field.flatchoices))
+            
+            def func(x):
+                x = force_str(codec.label(make_hashable(x), x), strings_only=True)
+                return None if x is None else to_representation(x)
+            
+            return model_field.attname, func
+        return None, None
+    
+    @staticmethod
+    def _fast_datetime(field):
+        """时区和格式在编译时确定，逻辑同 DateTimeField.to_representation"""
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        field_timezone = getattr(field, "timezone", field.default_timezone())
+        if not isinstance(output_format, str) or output_format.lower() == ISO_8601 or field_timezone is None:
+            return field.to_representation
+        
+        def func(x):
+            if not x:
+                return None
+            if isinstance(x, datetime.datetime) and timezone.is_aware(x):
+                return x.astimezone(field_timezone).strftime(output_format)
+            return field.to_representation(x)
+        
+        return func
 
 
 # ================================================================
 # view
 
+query_flight = SingleFlight("query")
+_view_executor = None
+
+
+def get_view_executor():
+    """异步视图执行同步处理流程的线程池，大小为 THREAD_NUMBER"""
+    global _view_executor
+    if _view_executor is None:
+        _view_executor = ThreadPoolExecutor(max_workers=config.THREAD_NUMBER, thread_name_prefix="view")
+    return _view_executor
+
+
+def run_sync_view(view, request, *args, **kwargs):
+    """在线程池中执行同步视图，线程复用，需要自行处理数据库连接"""
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response = response.render()
+        if getattr(response, "streaming", False):
+            # asgi 在事件循环中迭代流式数据，不能在其中查询数据库，只能在这里全部取出
+            response.streaming_content = list(response.streaming_content)
+        return response
+    finally:
+        close_old_connections()
+
+
 class BaseView(viewsets.GenericViewSet):
     resources = ""
     query_field = ()
@@ -154,6 +355,148 @@ class BaseView(viewsets.GenericViewSet):
     update_field = ()
     create_required_field = ()
     update_required_field = ("id",)
+    count_estimated = False  # 无过滤条件时使用表统计信息估算总数（已减去逻辑删除的数据），适用于超大表
+    stream_chunk_size = 1000  # 流式返回时每批从数据库读取的条数
+    coalesce = False  # 合并相同参数的并发查询，命中情况见 query_flight.get_stats()
+    coalesce_remote = False  # 同时跨进程合并，通过redis共享结果
+    cache_timeout = 0  # 查询结果在redis中的缓存时间（秒），0 表示不缓存
+    bulk_batch_size = 500  # 批量写入时每条 INSERT/UPDATE 语句的行数
+    noop_updates = Counter()  # 各资源因数据无变化而跳过写入的更新次数，所有视图共用，读取见 get_update_stats()
+    _noop_lock = threading.Lock()
+    
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        if config.ASYNC_VIEW:
+            return cls.as_async_view(actions, **initkwargs)
+        return super().as_view(actions, **initkwargs)
+    
+    @classmethod
+    def as_async_view(cls, actions=None, **initkwargs):
+        """
+        异步视图，用于asgi部署
+        认证、权限和数据库操作等同步流程放到有上限的线程池中执行，等待期间不占用事件循环，
+        单个进程可以同时挂起大量慢请求，超出线程池大小的请求在事件循环中排队
+        """
+        view = super().as_view(actions, **initkwargs)
+        
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                get_view_executor(), functools.partial(run_sync_view, view, request, *args, **kwargs))
+        
+        return async_view
+    
+    @classmethod
+    def get_update_stats(cls):
+        """跳过写入的更新次数 {resources: 次数}"""
+        with cls._noop_lock:
+            return dict(cls.noop_updates)
+    
+    def clear_cache(self):
+        self.queryset.model.clear_cache()
+    
+    def query_total(self, instance, data):
+        """
+        无过滤条件且开启 count_estimated 时使用表统计信息估算总数，
+        统计信息包含逻辑删除的数据，减去删除数（走 query_count 缓存）后才是有效数据的估算值，
+        queryset 上 is_deleted 以外的固定条件不会计入估算
+        """
+        if self.count_estimated and all(data.get(x, "") == "" for x in self.query_field):
+            total = estimate_count(instance)
+            if total is not None:
+                model = self.queryset.model
+                if issubclass(model, RichBaseModel):
+                    total -= query_count(model.objects.exclude(is_deleted=0))
+                return max(total, 0)
+        return query_count(instance)
+    
+    def serialize_list(self, instance):
+        serializer_class = self.get_serializer_class()
+        if serializer_class.fast_read:
+            return serializer_class.fast_data(instance)
+        return self.get_serializer(instance, many=True).data
+    
+    def query_page(self, instance, data):
+        """
+        查询分页：
+        传 cursor 和 limit 时使用游标分页，返回 next_cursor，首页 cursor 传空字符串
+        传 offset 和 limit 时使用页码分页，返回 total
+        都不传时返回全部数据
+        :return: (当前页数据, 分页信息)
+        """
+        offset = data.get("offset")
+        limit = data.get("limit")
+        cursor = data.get("cursor")
+        if cursor is not None and limit:
+            pag = CursorPager(instance, limit)
+            instance = pag.page(cursor)
+            return instance, {"next_cursor": pag.next_cursor}
+        if offset and limit:
+            pag = Pager(instance, limit, total=self.query_total(instance, data))
+            instance = pag.page(offset)
+            return instance, {"total": pag.total}
+        # 不分页时数据本身就要全部取出，直接使用结果长度，不再额外执行COUNT
+        return instance, {"total": len(instance)}
+    
+    def query_key(self, data):
+        """资源名 + 规范化后的查询参数，参数的顺序、类型和无关参数不影响结果"""
+        params = {x: str(data.get(x)) for x in self.query_field if data.get(x, "") != ""}
+        params.update({x: str(data.get(x)) for x in ("offset", "limit", "cursor") if data.get(x) is not None})
+        return f"{self.resources}:{hashlib.md5(json.dumps(params, sort_keys=True).encode()).hexdigest()}"
+    
+    def query(self, instance, data):
+        """分页并序列化，返回 json_resp 的参数"""
+        instance, page_info = self.query_page(instance, data)
+        return dict(data=self.serialize_list(instance), **page_info)
+    
+    def coalesce_query(self, instance, data):
+        if not self.coalesce:
+            return self.query(instance, data)
+        return query_flight.do(self.query_key(data), lambda: self.query(instance, data), remote=self.coalesce_remote)
+    
+    def cached_query(self, instance, data):
+        """
+        查询结果缓存，键中带有表的数据版本号，写操作后版本号加一，不会读到旧数据，也不需要逐个删除缓存
+        """
+        if not self.cache_timeout:
+            return self.coalesce_query(instance, data)
+        
+        key = f"query_cache:{get_generation(self.queryset.model)}:{self.query_key(data)}"
+        result = redis_store.get(key)
+        if result is not None:
+            return json.loads(result)
+        result = self.coalesce_query(instance, data)
+        redis_store.set(key, json.dumps(result, cls=DjangoJSONEncoder), ex=self.cache_timeout)
+        return result
+    
+    def is_stream(self, data):
+        """
+        不分页并且传了 stream 参数时流式返回全部数据
+        asgi 部署(async_view)时流式数据会在线程池中全部取出后再返回，失去流式的意义，直接拒绝
+        """
+        stream = str(data.get("stream")) in BooleanField.TRUE_VALUES and not (data.get("offset") and data.get("limit"))
+        if stream and config.ASYNC_VIEW:
+            raise PlusException("异步部署不支持流式导出，请使用 cursor 分页查询")
+        return stream
+    
+    def query_stream(self, instance):
+        """
+        按主键顺序分批读取并序列化，每批处理完即可释放，内存占用与结果总量无关
+        主键不会变化，导出过程中被修改的数据不会因为排序字段变化而漏掉或重复，输出顺序与分页查询不同
+        mysql 不支持服务端游标，queryset.iterator() 仍会把全部结果读到客户端，所以这里按主键分批查询
+        """
+        instance = instance.order_by("pk")
+        last_pk = None
+        while True:
+            batch = instance if last_pk is None else instance.filter(pk__gt=last_pk)
+            batch = list(batch[:self.stream_chunk_size])
+            if not batch:
+                return
+            last_pk = batch[-1].pk
+            yield self.serialize_list(batch)
+            if len(batch) < self.stream_chunk_size:
+                return
     
     @action(methods=["GET"], detail=False, url_path="get_query")
     def get_query(self, request, *args, **kwargs):
@@ -162,17 +505,9 @@ class BaseView(viewsets.GenericViewSet):
             params = {x: request.query_params.get(x) for x in self.query_field if request.query_params.get(x, "") != ""}
             
             instance = self.queryset.filter(**params).all()
-            offset = request.query_params.get("offset")
-            limit = request.query_params.get("limit")
-            if offset and limit:
-                pag = Pager(instance, limit)
-                instance = pag.page(offset)
-                total = pag.total
-            else:
-                instance = instance
-                total = len(instance)
-            serializer = self.get_serializer(instance, many=True)
-            return json_resp(RET.OK, f"{self.resources}查询成功", data=serializer.data, total=total)
+            if self.is_stream(request.query_params):
+                return json_stream_resp(RET.OK, f"{self.resources}查询成功", self.query_stream(instance))
+            return json_resp(RET.OK, f"{self.resources}查询成功", **self.cached_query(instance, request.query_params))
         except Exception as e:
             logger.error(f"{self.resources}查询错误 params:{request.query_params} error:{e}")
             return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}查询错误 error:{e}", data=None)
@@ -184,17 +519,9 @@ class BaseView(viewsets.GenericViewSet):
             params = {x: request.data.get(x) for x in self.query_field if request.data.get(x, "") != ""}
             
             instance = self.queryset.filter(**params).all()
-            offset = request.data.get("offset")
-            limit = request.data.get("limit")
-            if offset and limit:
-                pag = Pager(instance, limit)
-                instance = pag.page(offset)
-                total = pag.total
-            else:
-                instance = instance
-                total = len(instance)
-            serializer = self.get_serializer(instance, many=True)
-            return json_resp(RET.OK, f"{self.resources}查询成功", data=serializer.data, total=total)
+            if self.is_stream(request.data):
+                return json_stream_resp(RET.OK, f"{self.resources}查询成功", self.query_stream(instance))
+            return json_resp(RET.OK, f"{self.resources}查询成功", **self.cached_query(instance, request.data))
         except Exception as e:
             logger.error(f"{self.resources}查询错误 params:{request.data} error:{e}")
             return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}查询错误 error:{e}", data=None)
@@ -212,14 +539,197 @@ class BaseView(viewsets.GenericViewSet):
             serializer = self.get_serializer(data=params)
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            self.clear_cache()
             return json_resp(RET.OK, f"{self.resources}创建成功", data=serializer.data)
         except Exception as e:
             logger.error(f"{self.resources}创建错误 params:{request.data} error:{e}")
             return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}创建错误 error:{e}", data=None)
     
+    def bulk_rows(self, data):
+        """批量接口的数据，直接传列表或 {"data": [...]}"""
+        rows = data.get("data") if isinstance(data, dict) else data
+        if not isinstance(rows, list) or not rows:
+            raise PlusException("缺少data参数")
+        return rows
+    
+    def get_bulk_serializer(self, *args, **kwargs):
+        """
+        批量接口逐行校验使用的序列化器，去掉 unique_together 校验（每行一次查询），由 unique_conflicts 统一批量检查
+        """
+        serializer = self.get_serializer(*args, **kwargs)
+        serializer.validators = [x for x in serializer.validators if not isinstance(x, UniqueTogetherValidator)]
+        return serializer
+    
+    def unique_conflicts(self, data_list, pk_list=None):
+        """
+        按模型的 unique_together 检查批量数据的唯一性冲突：批次内重复 和 与数据库中已有数据重复
+        序列化器中不包含全部唯一字段时（如 is_deleted）不会生成唯一性校验，冲突只会在写入时整批失败，所以在写入前检查
+        不在数据中的字段取模型字段的默认值，每组唯一字段每 bulk_batch_size 行查询一次数据库
+        :param pk_list: 更新时每行对应的主键，数据库中的同一行不算冲突
+        :return: {行在 data_list 中的序号: 错误信息}
+        """
+        model = self.queryset.model
+        conflicts = {}
+        for fields in model._meta.unique_together:
+            defaults = {x: model._meta.get_field(x).get_default() for x in fields}
+            keys = [tuple(row.get(x, defaults[x]) for x in fields) for row in data_list]
+            exists = {}
+            for start in range(0, len(keys), self.bulk_batch_size):
+                chunk = keys[start:start + self.bulk_batch_size]
+                params = {f"{x}__in": {key[i] for key in chunk} for i, x in enumerate(fields)}
+                for row in model.objects.filter(**params).values_list("pk", *fields):
+                    exists.setdefault(row[1:], set()).add(row[0])
+            
+            seen = set()
+            for index, key in enumerate(keys):
+                if exists.get(key, set()) - {pk_list[index] if pk_list else None}:
+                    conflicts.setdefault(index, f"{','.join(fields)} 数据已存在")
+                elif key in seen:
+                    conflicts.setdefault(index, f"{','.join(fields)} 与前面的数据重复")
+                seen.add(key)
+        return conflicts
+    
+    @action(methods=["POST"], detail=False, url_path="bulk_create")
+    def bulk_create(self, request, *args, **kwargs):
+        """
+        批量创建，逐行校验必填参数、序列化器和唯一性，校验通过的数据按 bulk_batch_size 分批插入
+        返回创建条数和校验失败的行 [{"index": 行号, "error": 错误信息}]，有失败的行时返回 DATAERR
+        """
+        try:
+            rows = self.bulk_rows(request.data)
+            logger.info(f"{self.resources}批量创建 user:{request.user.username} count:{len(rows)}")
+            
+            index_list, data_list, errors = [], [], []
+            for index, row in enumerate(rows):
+                if not isinstance(row, dict):
+                    errors.append({"index": index, "error": "数据格式错误"})
+                    continue
+                params = {x: row.get(x) for x in self.create_field if row.get(x) is not None}
+                if not all([x in params for x in self.create_required_field]):
+                    errors.append({"index": index, "error": "缺少必填参数"})
+                    continue
+                
+                params["user"] = request.user.username
+                serializer = self.get_bulk_serializer(data=params)
+                if not serializer.is_valid():
+                    errors.append({"index": index, "error": serializer.errors})
+                    continue
+                index_list.append(index)
+                data_list.append(serializer.validated_data)
+            
+            conflicts = self.unique_conflicts(data_list)
+            if conflicts:
+                errors.extend({"index": index_list[i], "error": x} for i, x in conflicts.items())
+                errors.sort(key=lambda x: x["index"])
+                data_list = [x for i, x in enumerate(data_list) if i not in conflicts]
+            
+            with transaction.atomic():
+                self.queryset.model.data_bulk_create(data_list, batch_size=self.bulk_batch_size)
+            if data_list:
+                self.clear_cache()
+            
+            data = {"created": len(data_list), "errors": errors}
+            if errors:
+                logger.error(f"{self.resources}批量创建部分失败 errors:{errors[:10]}")
+                return json_resp(RET.DATAERR, f"{self.resources}批量创建失败{len(errors)}条", data=data)
+            return json_resp(RET.OK, f"{self.resources}批量创建成功", data=data)
+        except Exception as e:
+            logger.error(f"{self.resources}批量创建错误 params:{str(request.data)[:1000]} error:{e}")
+            return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}批量创建错误 error:{e}", data=None)
+    
     def update_queryset(self):
         return self.queryset
     
+    @action(methods=["PUT"], detail=False, url_path="bulk_update")
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        批量更新，每行为 {"id": id, 字段: 值}，只接受 update_field 中的字段
+        一次 IN 查询取出全部目标数据，逐行校验后只写入值有变化的字段，
+        变化字段相同的行合并为一组，每组按 bulk_batch_size 分批执行 bulk_update
+        返回更新条数、无变化条数和失败的行 [{"index": 行号, "error": 错误信息}]，有失败的行时返回 DATAERR
+        """
+        try:
+            rows = self.bulk_rows(request.data)
+            logger.info(f"{self.resources}批量更新 user:{request.user.username} count:{len(rows)}")
+            
+            # 先逐行检查格式并把 id 转换为主键类型，格式错误的行不影响其他行的 IN 查询
+            pk_field = self.queryset.model._meta.pk
+            items, errors = [], []
+            for index, row in enumerate(rows):
+                if not isinstance(row, dict):
+                    errors.append({"index": index, "error": "数据格式错误"})
+                    continue
+                params = {x: row.get(x) for x in self.update_field if row.get(x) is not None}
+                if not all([x in params for x in self.update_required_field]):
+                    errors.append({"index": index, "error": "缺少必填参数"})
+                    continue
+                try:
+                    pk = pk_field.to_python(params.pop("id"))
+                except Exception:
+                    errors.append({"index": index, "error": "id格式错误"})
+                    continue
+                items.append((index, pk, params))
+            
+            instance_map = self.update_queryset().in_bulk([x[1] for x in items])
+            updates, seen, unchanged = [], set(), 0
+            for index, pk, params in items:
+                instance = instance_map.get(pk)
+                if instance is None:
+                    errors.append({"index": index, "error": "数据不存在"})
+                    continue
+                if pk in seen:
+                    errors.append({"index": index, "error": "id重复"})
+                    continue
+                seen.add(pk)
+                
+                serializer = self.get_bulk_serializer(instance=instance, data=params, partial=True)
+                if not serializer.is_valid():
+                    errors.append({"index": index, "error": serializer.errors})
+                    continue
+                changed = {k: v for k, v in serializer.validated_data.items() if getattr(instance, k) != v}
+                if not changed:
+                    unchanged += 1
+                    continue
+                updates.append((index, instance, changed))
+            
+            # 唯一字段有变化的行，与数据库中其他行及批次内的其他行比较
+            unique_fields = {x for fields in self.queryset.model._meta.unique_together for x in fields}
+            checks = [x for x in updates if unique_fields & set(x[2])]
+            conflicts = self.unique_conflicts(
+                [{f: changed.get(f, getattr(instance, f)) for f in unique_fields} for _, instance, changed in checks],
+                pk_list=[instance.pk for _, instance, _ in checks])
+            conflict_indexes = set()
+            for i, error in conflicts.items():
+                conflict_indexes.add(checks[i][0])
+                errors.append({"index": checks[i][0], "error": error})
+            
+            groups = {}
+            for index, instance, changed in updates:
+                if index in conflict_indexes:
+                    continue
+                changed.update(id=instance.pk, user=request.user.username)
+                groups.setdefault(tuple(sorted(changed)), []).append(changed)
+            
+            model = self.queryset.model
+            with transaction.atomic():
+                for fields, data_list in groups.items():
+                    model.data_bulk_update(data_list, [x for x in fields if x != "id"], batch_size=self.bulk_batch_size)
+            if groups:
+                self.clear_cache()
+            if unchanged:
+                with self._noop_lock:
+                    self.noop_updates[self.resources] += unchanged
+            
+            errors.sort(key=lambda x: x["index"])
+            data = {"updated": sum(len(x) for x in groups.values()), "unchanged": unchanged, "errors": errors}
+            if errors:
+                logger.error(f"{self.resources}批量更新部分失败 errors:{errors[:10]}")
+                return json_resp(RET.DATAERR, f"{self.resources}批量更新失败{len(errors)}条", data=data)
+            return json_resp(RET.OK, f"{self.resources}批量更新成功", data=data)
+        except Exception as e:
+            logger.error(f"{self.resources}批量更新错误 params:{str(request.data)[:1000]} error:{e}")
+            return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}批量更新错误 error:{e}", data=None)
+    
     @action(methods=["PUT"], detail=False, url_path="update")
     def update(self, request, *args, **kwargs):
         try:
@@ -231,10 +741,20 @@ class BaseView(viewsets.GenericViewSet):
             pk = params.pop("id")
             
             instance = self.update_queryset().get(pk=pk)
-            params["user"] = request.user.username
             serializer = self.get_serializer(instance=instance, data=params, partial=True)
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            changed = {k: v for k, v in serializer.validated_data.items() if getattr(instance, k) != v}
+            if not changed:
+                with self._noop_lock:
+                    self.noop_updates[self.resources] += 1
+                logger.info(f"{self.resources}更新数据无变化，跳过写入 id:{pk}")
+                return json_resp(RET.OK, f"{self.resources}更新成功", data=serializer.data)
+            
+            changed["user"] = request.user.username
+            for k, v in changed.items():
+                setattr(instance, k, v)
+            instance.save(update_fields=[*changed, "update_time"])
+            self.clear_cache()
             return json_resp(RET.OK, f"{self.resources}更新成功", data=serializer.data)
         except Exception as e:
             logger.error(f"{self.resources}更新错误 params:{request.data} error:{e}")
@@ -245,20 +765,29 @@ class BaseView(viewsets.GenericViewSet):
     
     @action(methods=["DELETE"], detail=False, url_path="delete")
     def delete(self, request, *args, **kwargs):
+        """
+        逻辑删除，id 可以传单个或列表，受 delete_queryset 的条件限制
+        只更新 is_deleted、user、update_time 三个字段，返回实际删除的id列表
+        """
         try:
             logger.info(f"{self.resources}删除 user:{request.user.username} params:{request.data}")
             
             pk = request.data.get("id")
             is_deleted = request.data.get("is_deleted", True)
-            if pk is None:
+            if pk is None or pk == []:
                 raise PlusException("缺少id参数")
+            pk_list = pk if isinstance(pk, list) else [pk]
             
-            instance = self.delete_queryset().get(pk=pk)
-            instance.is_deleted = pk if is_deleted else 0
-            instance.user = request.user.username
-            instance.save()
+            with transaction.atomic():
+                affected = list(self.delete_queryset().filter(pk__in=pk_list).select_for_update()
+                                .values_list("pk", flat=True))
+                if not affected:
+                    raise PlusException("数据不存在", code=RET.NODATA)
+                self.queryset.model.objects.filter(pk__in=affected).update(
+                    is_deleted=F("id") if is_deleted else 0, user=request.user.username, update_time=timezone.now())
+            self.clear_cache()
             
-            return json_resp(RET.OK, f"{self.resources}删除成功", data=pk)
+            return json_resp(RET.OK, f"{self.resources}删除成功", data=affected)
         except Exception as e:
             logger.error(f"{self.resources}删除错误 params:{request.data} error:{e}")
             return json_resp(getattr(e, "code", RET.SERVERERR), f"{self.resources}删除错误 error:{e}", data=None)
@@ -274,6 +803,7 @@ class BaseView(viewsets.GenericViewSet):
             
             instance = self.delete_queryset().get(pk=pk)
             instance.delete()
+            self.clear_cache()
             
             return json_resp(RET.OK, f"{self.resources}删除成功", data=pk)
         except Exception as e:
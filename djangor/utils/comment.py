@@ -5,16 +5,32 @@
 # @Author  : wuyazibest
 # @Email   : wuyazibest@163.com
 # @Desc   :
+import asyncio
+import base64
+import hashlib
 import json
 import logging
+import threading
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 
+import aiohttp
 import datetime
 import redis
+import redis.asyncio as aioredis
 import requests
 import time
 
-from django.http import JsonResponse
-from jsonschema import validate
+from django.core.exceptions import EmptyResultSet
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from jsonschema import validators
+from jsonschema.exceptions import best_match
 from retrying import retry
 
 from djangor import config
@@ -29,6 +45,33 @@ def json_resp(code, message, **kwargs):
     return JsonResponse(kwargs)
 
 
+def json_stream_resp(code, message, chunks, **kwargs):
+    """
+    流式返回json，格式与 json_resp 一致，用于数据量很大的结果
+    :param chunks: 可迭代对象，每次产出一批已序列化的数据
+    total 在数据输出完后计算，code 和 message 放在最后，输出中途出错时仍可返回错误码
+    """
+    
+    def stream():
+        yield '{"data": ['
+        total = 0
+        ret = dict(kwargs, code=code, message=message or error_map.get(code, "未知消息"))
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                text = ", ".join(json.dumps(x, cls=DjangoJSONEncoder) for x in chunk)
+                yield text if not total else ", " + text
+                total += len(chunk)
+        except Exception as e:
+            logger.error(f"流式返回数据出错 error: {e}")
+            ret.update(code=RET.SERVERERR, message=f"{message} 数据输出中断 error:{e}")
+        ret["total"] = total
+        yield "], " + json.dumps(ret, cls=DjangoJSONEncoder)[1:]
+    
+    return StreamingHttpResponse(stream(), content_type="application/json")
+
+
 class PlusException(Exception):
     def __init__(self, *args, code=RET.PARAMERR, status=None, **kwargs):
         super(PlusException, self).__init__(*args)
@@ -39,27 +82,134 @@ class PlusException(Exception):
 
 
 class Redis(object):
+    """
+    redis 操作失败时记录日志并返回None，不影响主流程
+    相同连接参数的实例在进程内共享同一个有上限的连接池，long 参数仅为兼容保留
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+    
     def __init__(self, host='localhost', port=6379, db=0, decode_responses=True, long=False, **kwargs):
         self.__kw = dict(host=host, port=port, db=db, decode_responses=decode_responses, **kwargs)
         self.long = long
-        if self.long:
-            connection_pool = redis.ConnectionPool(**self.__kw)
-            self.__long_conn = redis.Redis(connection_pool=connection_pool)
+        self.__conn = redis.Redis(connection_pool=self.get_pool(**self.__kw))
+    
+    @classmethod
+    def get_pool(cls, **kwargs):
+        kwargs.setdefault("max_connections", config.RedisConf.max_connections)
+        kwargs.setdefault("health_check_interval", config.RedisConf.health_check_interval)
+        kwargs.setdefault("socket_timeout", config.RedisConf.socket_timeout)
+        key = tuple(sorted(kwargs.items()))
+        pool = cls._pools.get(key)
+        if pool is None:
+            with cls._pools_lock:
+                # 连接池满时等待空闲连接，超过 socket_timeout 仍未获取到则报错
+                pool = cls._pools.setdefault(key, redis.BlockingConnectionPool(timeout=kwargs["socket_timeout"], **kwargs))
+        return pool
+    
+    def __getattr__(self, item):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        method = getattr(self.__conn, item)
+        
+        def _(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"redis操作失败 {e}")
+        
+        # 缓存到实例上，之后的访问不再经过 __getattr__
+        self.__dict__[item] = _
+        return _
+    
+    @contextmanager
+    def batch(self, transaction=False):
+        """
+        批量执行，上下文中的命令在退出时一次性发送，只需要一次网络往返
+            with redis_store.batch() as pipe:
+                pipe.set("a", 1, ex=60)
+                pipe.expire("b", 60)
+            pipe.results
+        执行失败时记录日志，results 为 None
+        """
+        pipe = self.__conn.pipeline(transaction=transaction)
+        yield pipe
+        try:
+            pipe.results = pipe.execute()
+        except Exception as e:
+            logger.error(f"redis批量操作失败 {e}")
+            pipe.results = None
+    
+    def mget_map(self, keys):
+        """批量读取，返回 {key: value}，不存在的键值为None"""
+        keys = list(keys)
+        values = self.mget(keys) if keys else []
+        return dict(zip(keys, values or [None] * len(keys)))
+    
+    def mset_ex(self, mapping, ex=None):
+        """批量写入并设置有效期，一次网络往返"""
+        with self.batch() as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+        return pipe.results
+
+
+class AsyncRedis(object):
+    """
+    Redis 的 asyncio 版本，方法均为协程，操作失败时同样记录日志并返回None
+    连接池与事件循环绑定，每个事件循环使用各自的连接池
+    """
+    
+    def __init__(self, host='localhost', port=6379, db=0, decode_responses=True, **kwargs):
+        self.__kw = dict(host=host, port=port, db=db, decode_responses=decode_responses, **kwargs)
+        self.__kw.setdefault("max_connections", config.RedisConf.max_connections)
+        self.__kw.setdefault("health_check_interval", config.RedisConf.health_check_interval)
+        self.__kw.setdefault("socket_timeout", config.RedisConf.socket_timeout)
+        self.__conns = weakref.WeakKeyDictionary()
     
     @property
     def __conn(self):
-        if self.long:
-            return self.__long_conn
-        return redis.Redis(**self.__kw)
+        loop = asyncio.get_running_loop()
+        conn = self.__conns.get(loop)
+        if conn is None:
+            pool = aioredis.BlockingConnectionPool(timeout=self.__kw["socket_timeout"], **self.__kw)
+            conn = self.__conns[loop] = aioredis.Redis(connection_pool=pool)
+        return conn
     
     def __getattr__(self, item):
-        def _(*args, **kwargs):
+        if item.startswith("_"):
+            raise AttributeError(item)
+        
+        async def _(*args, **kwargs):
             try:
-                return getattr(self.__conn, item)(*args, **kwargs)
+                return await getattr(self.__conn, item)(*args, **kwargs)
             except Exception as e:
                 logger.error(f"redis操作失败 {e}")
         
+        self.__dict__[item] = _
         return _
+    
+    @asynccontextmanager
+    async def batch(self, transaction=False):
+        """同 Redis.batch"""
+        pipe = self.__conn.pipeline(transaction=transaction)
+        yield pipe
+        try:
+            pipe.results = await pipe.execute()
+        except Exception as e:
+            logger.error(f"redis批量操作失败 {e}")
+            pipe.results = None
+    
+    async def mget_map(self, keys):
+        keys = list(keys)
+        values = await self.mget(keys) if keys else []
+        return dict(zip(keys, values or [None] * len(keys)))
+    
+    async def mset_ex(self, mapping, ex=None):
+        async with self.batch() as pipe:
+            for key, value in mapping.items():
+                pipe.set(key, value, ex=ex)
+        return pipe.results
 
 
 redis_store = Redis(host=config.RedisConf.host, port=config.RedisConf.port, db=config.RedisConf.db2, long=True)  # type: redis.Redis
@@ -69,15 +219,322 @@ def redis_conn(db=None) -> redis.Redis:
     return Redis(host=config.RedisConf.host, port=config.RedisConf.port, db=db or config.RedisConf.db1)
 
 
+aredis_store = AsyncRedis(host=config.RedisConf.host, port=config.RedisConf.port, db=config.RedisConf.db2)  # type: aioredis.Redis
+
+
+def aredis_conn(db=None) -> aioredis.Redis:
+    return AsyncRedis(host=config.RedisConf.host, port=config.RedisConf.port, db=db or config.RedisConf.db1)
+
+
+class LocalCache(object):
+    """
+    进程内缓存，带过期时间和数量上限，超出上限时淘汰最早写入的数据
+    """
+    
+    def __init__(self, timeout=60, max_size=1024):
+        self.timeout = timeout
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return default
+        return item[1]
+    
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + (timeout or self.timeout), value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def delete_where(self, func):
+        """删除值满足条件的数据"""
+        with self._lock:
+            for key in [k for k, v in self._data.items() if func(v[1])]:
+                self._data.pop(key)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class VersionedCache(object):
+    """
+    两级缓存：进程内缓存 + redis
+    redis 中保存版本号，数据按版本号存放，进程内缓存命中时只需读取一次版本号确认数据未失效
+    invalidate 时版本号加一，所有进程下次读取时都会重新获取
+    缓存未命中时通过redis锁保证只有一个进程调用 loader 重建数据，其他进程等待重建结果
+    """
+    
+    def __init__(self, key, loader, timeout=None, local_timeout=60, lock_timeout=10, wait_time=0.05):
+        """
+        :param loader: 重建数据的函数，返回值需要可以json序列化
+        :param timeout: redis 中数据的有效期
+        :param local_timeout: 进程内缓存的有效期，redis 不可用时最多使用这么久的旧数据
+        :param lock_timeout: 重建锁的有效期，也是其他进程等待的最长时间
+        """
+        self.key = key
+        self.loader = loader
+        self.timeout = timeout or config.RedisConf.expires
+        self.local = LocalCache(local_timeout, max_size=2)
+        self.lock_timeout = lock_timeout
+        self.wait_time = wait_time
+    
+    @property
+    def version_key(self):
+        return f"{self.key}:version"
+    
+    def get(self):
+        version = redis_store.get(self.version_key) or "0"
+        data = self.local.get(version)
+        if data is not None:
+            return data
+        
+        data_key = f"{self.key}:{version}"
+        data = redis_store.get(data_key)
+        if data is None:
+            data = self._rebuild(data_key)
+        data = json.loads(data)
+        self.local.set(version, data)
+        return data
+    
+    def _rebuild(self, data_key):
+        lock_key = f"{data_key}:lock"
+        if redis_store.set(lock_key, 1, ex=self.lock_timeout, nx=True):
+            try:
+                data = json.dumps(self.loader())
+                redis_store.set(data_key, data, ex=self.timeout)
+            finally:
+                redis_store.delete(lock_key)
+            return data
+        
+        # 其他进程正在重建，等待锁释放，redis 不可用时 exists 返回 None 直接自行加载
+        deadline = time.monotonic() + self.lock_timeout
+        while redis_store.exists(lock_key) and time.monotonic() < deadline:
+            time.sleep(self.wait_time)
+        data = redis_store.get(data_key)
+        if data is None:
+            data = json.dumps(self.loader())
+        return data
+    
+    def invalidate(self):
+        redis_store.incr(self.version_key)
+        self.local.clear()
+    
+    async def aget(self):
+        """get 的异步版本，与同步版本共用进程内缓存和redis中的数据，loader 在线程中执行"""
+        version = await aredis_store.get(self.version_key) or "0"
+        data = self.local.get(version)
+        if data is not None:
+            return data
+        
+        data_key = f"{self.key}:{version}"
+        data = await aredis_store.get(data_key)
+        if data is None:
+            data = await self._arebuild(data_key)
+        data = json.loads(data)
+        self.local.set(version, data)
+        return data
+    
+    async def _arebuild(self, data_key):
+        lock_key = f"{data_key}:lock"
+        if await aredis_store.set(lock_key, 1, ex=self.lock_timeout, nx=True):
+            try:
+                data = json.dumps(await sync_to_async(self.loader)())
+                await aredis_store.set(data_key, data, ex=self.timeout)
+            finally:
+                await aredis_store.delete(lock_key)
+            return data
+        
+        deadline = time.monotonic() + self.lock_timeout
+        while await aredis_store.exists(lock_key) and time.monotonic() < deadline:
+            await asyncio.sleep(self.wait_time)
+        data = await aredis_store.get(data_key)
+        if data is None:
+            data = json.dumps(await sync_to_async(self.loader)())
+        return data
+    
+    async def ainvalidate(self):
+        await aredis_store.incr(self.version_key)
+        self.local.clear()
+
+
+class SingleFlight(object):
+    """
+    合并相同 key 的并发调用，同一时刻只执行一次，其他调用等待并共享结果
+    remote=True 时再通过redis锁跨进程合并，结果在redis中保留 result_timeout 秒供等待的进程读取，需要可以json序列化
+    stats 计数：miss 实际执行，hit 共享了本进程其他线程的结果，remote_hit 共享了其他进程的结果
+    """
+    
+    def __init__(self, name, result_timeout=2, wait_timeout=10, wait_time=0.02):
+        self.name = name
+        self.result_timeout = result_timeout
+        self.wait_timeout = wait_timeout
+        self.wait_time = wait_time
+        self.stats = Counter()
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+    
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+    
+    def do(self, key, func, remote=False):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        
+        if not leader:
+            if call["event"].wait(self.wait_timeout):
+                self._count("hit")
+                if call["error"] is not None:
+                    raise call["error"]
+                return call["result"]
+            logger.warning(f"合并请求等待超时 {self.name} {key}")
+            self._count("miss")
+            return func()
+        
+        try:
+            call["result"] = self._remote_do(key, func) if remote else self._local_do(func)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["event"].set()
+    
+    def _local_do(self, func):
+        self._count("miss")
+        return func()
+    
+    def _remote_do(self, key, func):
+        result_key = f"single_flight:{self.name}:{key}"
+        lock_key = f"{result_key}:lock"
+        if redis_store.set(lock_key, 1, ex=self.wait_timeout, nx=True):
+            try:
+                result = self._local_do(func)
+                redis_store.set(result_key, json.dumps(result, cls=DjangoJSONEncoder), ex=self.result_timeout)
+            finally:
+                redis_store.delete(lock_key)
+            return result
+        
+        # 其他进程正在执行，等待其结果，redis 不可用时 exists 返回 None 直接自行执行
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            result = redis_store.get(result_key)
+            if result is not None:
+                self._count("remote_hit")
+                return json.loads(result)
+            if not redis_store.exists(lock_key):
+                break
+            time.sleep(self.wait_time)
+        return self._local_do(func)
+
+
+def generation_key(model):
+    return f"generation:{model._meta.db_table}"
+
+
+def get_generation(model):
+    """
+    表的数据版本号，缓存键中带上版本号，数据变更时版本号加一，旧缓存不会再被读取，等待自然过期
+    """
+    return redis_store.get(generation_key(model)) or "0"
+
+
+def bump_generation(model):
+    redis_store.incr(generation_key(model))
+
+
+async def aget_generation(model):
+    return await aredis_store.get(generation_key(model)) or "0"
+
+
+async def abump_generation(model):
+    await aredis_store.incr(generation_key(model))
+
+
+def count_cache_key(model, generation, sql_hash):
+    return f"query_count:{model._meta.db_table}:{generation}:{sql_hash}"
+
+
+def clear_count(model):
+    """
+    清除表的查询总数缓存，每个过滤条件单独一个键，键中带有表的数据版本号，版本号加一后旧的总数不会再被读取，各自过期
+    """
+    bump_generation(model)
+
+
+async def aclear_count(model):
+    await abump_generation(model)
+
+
+def estimate_count(queryset):
+    """
+    读取mysql表统计信息中的估算行数，不执行COUNT，非mysql数据库返回None
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "mysql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def query_count(queryset, estimated=False):
+    """
+    查询结果总数，使用 COUNT(*) 而不是取出全部数据
+    结果按表的数据版本号和过滤条件缓存在redis中，每个键单独设置有效期 count_expires 秒，数据变更时通过 clear_count 失效
+    :param estimated: 使用表统计信息估算总数，适用于超大表
+    """
+    if estimated:
+        total = estimate_count(queryset)
+        if total is not None:
+            return total
+    
+    try:
+        sql, sql_params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    sql_hash = hashlib.md5(f"{sql} {sql_params}".encode()).hexdigest()
+    key = count_cache_key(queryset.model, get_generation(queryset.model), sql_hash)
+    
+    cache = redis_store.get(key)
+    if cache is not None:
+        return int(cache)
+    
+    total = queryset.count()
+    redis_store.set(key, total, ex=config.RedisConf.count_expires)
+    return total
+
+
 class Pager(object):
-    def __init__(self, object_list, limit):
+    def __init__(self, object_list, limit, total=None):
         self.object_list = object_list
         self.limit = int(limit)
-        self.total = len(self.object_list)
+        self.total = len(self.object_list) if total is None else total
     
     def page(self, offset):
         try:
-            if not (isinstance(offset, int) or offset.isdecimail()):
+            if not (isinstance(offset, int) or offset.isdecimal()):
                 offset = 1
             else:
                 offset = int(offset)
@@ -97,16 +554,81 @@ class Pager(object):
         return ret
 
 
-@retry(stop_max_attempt_number=2)
+class CursorPager(object):
+    """
+    游标分页：按 (update_time, id) 倒序定位下一页的起点，不需要扫描并丢弃前面的数据，翻页耗时与页数无关
+    游标对前端不透明，首页传空字符串，之后传上一页返回的 next_cursor，next_cursor 为 None 时表示没有下一页
+    """
+    ordering = ("-update_time", "-pk")
+    
+    def __init__(self, object_list, limit):
+        self.object_list = object_list.order_by(*self.ordering)
+        self.limit = int(limit)
+        self.next_cursor = None
+    
+    @staticmethod
+    def encode_cursor(update_time, pk):
+        raw = json.dumps([update_time.isoformat(), pk]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            update_time, pk = json.loads(raw)
+            return datetime.datetime.fromisoformat(update_time), int(pk)
+        except Exception as e:
+            raise PlusException(f"cursor参数错误 error: {e}")
+    
+    def page(self, cursor=None):
+        self.next_cursor = None
+        object_list = self.object_list
+        if cursor:
+            update_time, pk = self.decode_cursor(cursor)
+            object_list = object_list.filter(Q(update_time__lt=update_time) | Q(update_time=update_time, pk__lt=pk))
+        
+        # 多取一条用于判断是否还有下一页
+        ret = list(object_list[:self.limit + 1])
+        if len(ret) > self.limit:
+            ret = ret[:self.limit]
+            self.next_cursor = self.encode_cursor(ret[-1].update_time, ret[-1].pk)
+        return ret
+
+
+_http_session = None
+_url_executor = None
+
+
+def get_http_session():
+    """
+    进程内共享的 http 会话，保持长连接，每个域名最多保持 REQUEST_POOL_SIZE 个连接，连接用完时等待
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=config.REQUEST_POOL_SIZE, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session = session
+    return _http_session
+
+
+def get_url_executor():
+    global _url_executor
+    if _url_executor is None:
+        _url_executor = ThreadPoolExecutor(max_workers=config.THREAD_NUMBER, thread_name_prefix="parse_url")
+    return _url_executor
+
+
+@retry(stop_max_attempt_number=config.DEFAULT_REQUEST_RETRY)
 def _parse_url(method, url, **kwargs):
     if method.upper() in ["GET"]:
-        kwargs.setdefault('allow_redirects', default=True)
+        kwargs.setdefault('allow_redirects', True)
     tt = time.time()
-    resp = requests.request(method, url, timeout=10, **kwargs)
-    logger.debug(f">>>> time:{(time.time()-tt):.3f} url: {method} {resp.url}")
+    resp = get_http_session().request(method, url, timeout=config.DEFAULT_REQUEST_TIMEOUT, **kwargs)
+    logger.debug(f">>>> time:{(time.time()-tt):.3f} url: {method} {resp.url} status:{resp.status_code}")
     if resp.status_code != 200:
         raise Exception(resp.content.decode())
-    print(f"========= \n {json.dumps(kwargs,ensure_ascii=False)} \n {resp.content.decode()} \n ===============")
     return resp.json()
 
 
@@ -122,6 +644,109 @@ def parse_url(url, params=None, data=None, json=None, headers=None, method="GET"
     return resp_json
 
 
+def parse_urls(calls, raise_exception=False):
+    """
+    并发请求多个地址，线程池大小为 THREAD_NUMBER
+    :param calls: parse_url 的参数列表，例如 [{"url": url, "params": {...}}, {"url": url, "method": "POST", "json": {...}}]
+    :return: 与 calls 顺序一致的结果列表，请求失败的结果为空字典，raise_exception=True 时抛出第一个失败的异常
+    """
+    executor = get_url_executor()
+    futures = [executor.submit(parse_url, raise_exception=raise_exception, **x) for x in calls]
+    return [x.result() for x in futures]
+
+
+async def _aparse_url(session, method, url, **kwargs):
+    if method.upper() in ["GET"]:
+        kwargs.setdefault('allow_redirects', True)
+    error = None
+    for _ in range(config.DEFAULT_REQUEST_RETRY):
+        tt = time.time()
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                content = await resp.read()
+                logger.debug(f">>>> time:{(time.time()-tt):.3f} url: {method} {resp.url} status:{resp.status}")
+                if resp.status != 200:
+                    raise Exception(content.decode())
+                return await resp.json(content_type=None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+    raise error
+
+
+async def aparse_url(url, params=None, data=None, json=None, headers=None, method="GET", raise_exception=False,
+                     timeout=None, session=None):
+    """
+    parse_url 的异步版本，失败时返回空字典或抛出异常
+    :param timeout: 单次调用的总时限(包含重试)，默认 DEFAULT_REQUEST_TIMEOUT
+    :param session: 复用的 aiohttp.ClientSession，不传时临时创建
+    """
+    timeout = timeout or config.DEFAULT_REQUEST_TIMEOUT
+    try:
+        if session is None:
+            async with aiohttp.ClientSession() as session:
+                coro = _aparse_url(session, method, url, params=params, data=data, json=json, headers=headers)
+                resp_json = await asyncio.wait_for(coro, timeout)
+        else:
+            coro = _aparse_url(session, method, url, params=params, data=data, json=json, headers=headers)
+            resp_json = await asyncio.wait_for(coro, timeout)
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            e = f"超时 {timeout}s"
+        msg = f"地址请求失败 {method} {url} kwargs:{params or data or json} error:{e}"
+        logger.error(msg)
+        resp_json = {}
+        if raise_exception:
+            raise Exception(msg)
+    return resp_json
+
+
+async def aparse_urls(calls, concurrency=None, timeout=None, budget=None, raise_exception=False):
+    """
+    异步并发请求多个地址，按完成顺序逐个返回
+    async for index, resp_json in aparse_urls([{"url": url}, {"url": url, "method": "POST", "json": {...}}]):
+        ...
+    :param calls: aparse_url 的参数列表
+    :param concurrency: 同时进行的请求数，默认 REQUEST_POOL_SIZE
+    :param timeout: 单次调用的时限，默认 DEFAULT_REQUEST_TIMEOUT
+    :param budget: 整批请求的总时限，超出后未完成的请求取消，结果为空字典，raise_exception=True 时抛出异常
+    :return: (calls 中的下标, 结果)
+    """
+    concurrency = concurrency or config.REQUEST_POOL_SIZE
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=config.REQUEST_POOL_SIZE)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def _call(kwargs):
+            async with semaphore:
+                return await aparse_url(timeout=timeout, raise_exception=raise_exception, session=session, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        end_time = loop.time() + budget if budget else None
+        pending = {asyncio.ensure_future(_call(x)): i for i, x in enumerate(calls)}
+        try:
+            while pending:
+                wait_time = None if end_time is None else max(end_time - loop.time(), 0)
+                done, _ = await asyncio.wait(pending, timeout=wait_time, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    for future in pending:
+                        future.cancel()
+                    break
+                for future in done:
+                    yield pending.pop(future), future.result()
+            if pending:
+                msg = f"批量请求超出总时限 {budget}s 未完成:{len(pending)}/{len(calls)}"
+                logger.error(msg)
+                if raise_exception:
+                    raise Exception(msg)
+                for index in sorted(pending.values()):
+                    yield index, {}
+        finally:
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
 def get_request_ip(request):
     x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
     if x_forwarded_for:
@@ -131,13 +756,65 @@ def get_request_ip(request):
     return request_ip
 
 
+def _is_array(checker, instance):
+    return isinstance(instance, (list, tuple))
+
+
+_validator_classes = {}
+_validator_cache = LocalCache(timeout=24 * 3600, max_size=512)
+
+
+def get_validator(schema):
+    """
+    编译并缓存 schema 的校验器，schema 只检查一次，array 类型同时接受 list 和 tuple
+    优先按对象 id 查找，常量 schema 不需要序列化，未命中时按内容哈希查找，动态生成的相同 schema 共用校验器
+    """
+    item = _validator_cache.get(id(schema))
+    if item is not None and item[0] is schema:
+        return item[1]
+    
+    digest = hashlib.md5(json.dumps(schema, sort_keys=True, default=str).encode()).hexdigest()
+    validator = _validator_cache.get(digest)
+    if validator is None:
+        base = validators.validator_for(schema)
+        cls = _validator_classes.get(base)
+        if cls is None:
+            cls = validators.extend(base, type_checker=base.TYPE_CHECKER.redefine("array", _is_array))
+            _validator_classes[base] = cls
+        cls.check_schema(schema)
+        validator = cls(schema)
+        _validator_cache.set(digest, validator)
+    _validator_cache.set(id(schema), (schema, validator))
+    return validator
+
+
+def _validate_error(validator, instance):
+    error = best_match(validator.iter_errors(instance))
+    return None if error is None else error.message
+
+
 def check_json(instance, schema):
     try:
-        validate(instance, schema, types=dict(array=(list, tuple)))
-        return True
+        error = _validate_error(get_validator(schema), instance)
     except Exception as e:
-        logger.error(f"json数据校验失败:{instance}   error: %s" % e)
+        error = e
+    if error is not None:
+        logger.error(f"json数据校验失败:{instance}   error: %s" % error)
         return False
+    return True
+
+
+def check_json_many(instances, schema):
+    """
+    使用同一个校验器批量校验
+    :return: 与 instances 顺序一致的错误信息列表，校验通过的为 None
+    """
+    validator = get_validator(schema)
+    errors = [_validate_error(validator, x) for x in instances]
+    failed = [f"{i}:{x}" for i, x in enumerate(errors) if x is not None]
+    if failed:
+        logger.error(f"json数据批量校验失败 {len(failed)}/{len(errors)} error: {failed[:10]}")
+    return errors
 
 
 def check_datetime_fmt(date_str, fmt="%Y-%m-%d %H:%M:%S"):
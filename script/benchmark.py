@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# @File    : benchmark.py
+# @Time    : 2020/10/18 16:20
+# @Author  : wuyazibest
+# @Email   : wuyazibest@163.com
+# @Desc    : 性能测试，在项目根目录执行 python -m script.benchmark <name> [-n 次数]
+import argparse
+import os
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangor.settings")
+
+
+def bench(name, func, number):
+    func()  # 预热
+    tt = time.perf_counter()
+    for _ in range(number):
+        func()
+    cost = time.perf_counter() - tt
+    print(f"{name:<40} {number / cost:>12.1f} ops/sec  {cost / number * 1000:.3f} ms/op")
+    return cost
+
+
+def bench_redis(number):
+    """每次新建连接 与 进程内连接池 对比，以及逐个写入与批量写入对比"""
+    import redis
+    from djangor import config
+    from djangor.utils import Redis
+    
+    kw = dict(host=config.RedisConf.host, port=config.RedisConf.port, db=config.RedisConf.db1, decode_responses=True)
+    pooled = Redis(**kw)
+    keys = [f"benchmark:{i}" for i in range(20)]
+    
+    bench("get 每次新建连接", lambda: redis.Redis(**kw).get("benchmark"), number)
+    bench("get 连接池", lambda: pooled.get("benchmark"), number)
+    bench("set 20个键 逐个执行", lambda: [pooled.set(x, 1, ex=60) for x in keys], number // 20 or 1)
+    bench("set 20个键 mset_ex", lambda: pooled.mset_ex({x: 1 for x in keys}, ex=60), number // 20 or 1)
+    bench("get 20个键 mget_map", lambda: pooled.mget_map(keys), number // 20 or 1)
+    pooled.delete(*keys)
+
+
+def bench_aredis(number):
+    """异步客户端单次延迟，以及并发请求时的总耗时，可以指向本地的 redis 替身服务"""
+    import asyncio
+    from djangor.utils import redis_store, aredis_store
+    
+    async def run():
+        await aredis_store.get("benchmark")
+        tt = time.perf_counter()
+        for _ in range(number):
+            await aredis_store.get("benchmark")
+        cost = time.perf_counter() - tt
+        print(f"{'get 异步 顺序执行':<40} {number / cost:>12.1f} ops/sec  {cost / number * 1000:.3f} ms/op")
+        
+        tt = time.perf_counter()
+        await asyncio.gather(*[aredis_store.get("benchmark") for _ in range(number)])
+        cost = time.perf_counter() - tt
+        print(f"{'get 异步 并发执行':<40} {number / cost:>12.1f} ops/sec  {cost / number * 1000:.3f} ms/op")
+    
+    bench("get 同步 顺序执行", lambda: redis_store.get("benchmark"), number)
+    asyncio.run(run())
+
+
+def bench_auth(number, username="api_user", password=""):
+    """api 认证 每次查询数据库 与 使用认证缓存 对比，需要数据库中存在对应的用户"""
+    from djangor.utils.auth import ApiAuthentication, PublicAuthentication
+    
+    for auth in (ApiAuthentication(), PublicAuthentication()):
+        realm = auth.www_authenticate_realm
+        bench(f"{realm} 认证 查询数据库", lambda: auth.load_credentials(username, password), number)
+        bench(f"{realm} 认证 缓存", lambda: auth.authenticate_credentials(username, password), number)
+
+
+def bench_authenticate(number):
+    """认证阶段耗时：依次尝试所有认证类 与 按认证方式分发 对比，使用不查询数据库的认证信息"""
+    from django.contrib.auth.models import AnonymousUser
+    from django.test import RequestFactory
+    from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+    from rest_framework.request import Request
+    from rest_framework_jwt.authentication import JSONWebTokenAuthentication
+    from djangor.utils.auth import ApiAuthentication, ThirdPartyAuthentication, SchemeAuthentication
+    
+    chain = [ApiAuthentication, ThirdPartyAuthentication, JSONWebTokenAuthentication, SessionAuthentication,
+             BasicAuthentication]
+    
+    def run(classes, meta):
+        req = RequestFactory().get("/", **meta)
+        req.user = AnonymousUser()
+        try:
+            return Request(req, authenticators=[x() for x in classes]).user
+        except Exception:
+            return None
+    
+    cases = {
+        "匿名": {},
+        "JWT": {"HTTP_AUTHORIZATION": "JWT benchmark.invalid.token"},
+        "Basic": {"HTTP_AUTHORIZATION": "Basic benchmark"},
+        }
+    for name, meta in cases.items():
+        bench(f"{name} 依次尝试", lambda: run(chain, meta), number)
+        bench(f"{name} 按方式分发", lambda: run([SchemeAuthentication], meta), number)
+
+
+def bench_json(number):
+    """json 校验：每次 jsonschema.validate 与 缓存编译后的校验器 对比，以及单条逐个校验与批量校验对比"""
+    import warnings
+    from jsonschema import validate
+    from djangor.utils.comment import check_json, check_json_many
+    
+    schema = {
+        "type": "object",
+        "properties": {
+            "name": {"type": "string", "maxLength": 64},
+            "kind": {"type": "integer", "enum": [1, 2, 3]},
+            "labels": {"type": "array", "items": {"type": "integer"}},
+            },
+        "required": ["name", "kind"],
+        }
+    instance = {"name": "benchmark", "kind": 1, "labels": (1, 2, 3)}
+    batch = [instance] * 100
+    
+    warnings.simplefilter("ignore", DeprecationWarning)
+    bench("每次 validate", lambda: validate(instance, schema, types=dict(array=(list, tuple))), number)
+    bench("缓存校验器 check_json", lambda: check_json(instance, schema), number)
+    bench("100 条 逐个 check_json", lambda: [check_json(x, schema) for x in batch], max(number // 100, 1))
+    bench("100 条 check_json_many", lambda: check_json_many(batch, schema), max(number // 100, 1))
+
+
+def bench_load(number, url=None, concurrency=100, headers=None):
+    """
+    并发压测，分别对 wsgi(uwsgi) 和 asgi(uvicorn + async_view) 部署执行后对比结果
+    python -m script.benchmark load -n 2000 --url http://127.0.0.1:9002/books/book/?offset=1&limit=20 -c 200
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    
+    def fetch(_):
+        tt = time.perf_counter()
+        try:
+            ok = session.get(url, headers=headers, timeout=60).status_code == 200
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - tt
+    
+    tt = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(number)))
+    cost = time.perf_counter() - tt
+    
+    latency = sorted(x[1] for x in results)
+    failed = len([x for x in results if not x[0]])
+    print(f"{url} 并发:{concurrency} 请求数:{number} 失败:{failed}")
+    print(f"{number / cost:.1f} req/sec  p50:{latency[len(latency) // 2] * 1000:.1f}ms  "
+          f"p99:{latency[int(len(latency) * 0.99) - 1] * 1000:.1f}ms  max:{latency[-1] * 1000:.1f}ms")
+
+
+BENCHMARKS = {
+    "redis": bench_redis,
+    "aredis": bench_aredis,
+    "load": bench_load,
+    "auth": bench_auth,
+    "authenticate": bench_authenticate,
+    "json": bench_json,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能测试")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("-n", "--number", type=int, default=2000, help="执行次数")
+    parser.add_argument("--url", help="load: 压测地址")
+    parser.add_argument("-c", "--concurrency", type=int, default=100, help="load: 并发数")
+    parser.add_argument("-H", "--header", action="append", default=[], help="load: 请求头，例如 'Authorization: JWT xxx'")
+    parser.add_argument("--username", default="api_user", help="auth: 用户名")
+    parser.add_argument("--password", default="", help="auth: 密码，与数据库中存储的值一致")
+    args = parser.parse_args()
+    
+    if args.name == "load":
+        headers = dict(x.split(":", 1) for x in args.header)
+        bench_load(args.number, args.url, args.concurrency, {k.strip(): v.strip() for k, v in headers.items()})
+        return
+    
+    import django
+    django.setup()
+    if args.name == "auth":
+        bench_auth(args.number, args.username, args.password)
+        return
+    BENCHMARKS[args.name](args.number)
+
+
+if __name__ == "__main__":
+    main()